@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+import time
+from enum import Enum
+
+
+class Admission(Enum):
+    ADMIT = "admit"
+    # Admitted, but the user is told about the long expected wait
+    WARN = "warn"
+    # Not admitted, the user is asked to come back later
+    DEFER = "defer"
+
+
+class RateEstimator(object):
+    """Exponentially weighted rate of events per second with the time constant tau in seconds.
+
+    Every event adds 1 / tau to the rate, which decays by exp(-dt / tau) in between. While less than a few tau have
+    passed since the start, the rate is corrected for the missing history, assuming at least a quarter of tau has passed
+    so that a burst of events right after the start doesn't yield a huge rate."""
+
+    def __init__(self, tau, now=None):
+        self.tau = tau
+        self.events = 0
+        self._start = time.monotonic() if now is None else now
+        self._rate = 0.0
+        self._last = self._start
+
+    def _decay(self, now):
+        if now > self._last:
+            self._rate *= math.exp((self._last - now) / self.tau)
+            self._last = now
+
+    def record(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._decay(now)
+        self._rate += 1.0 / self.tau
+        self.events += 1
+
+    def rate(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._decay(now)
+        elapsed = max(now - self._start, self.tau / 4)
+        return self._rate / (1.0 - math.exp(-elapsed / self.tau))
+
+
+class AdmissionController(object):
+    """Decides whether new users are admitted based on the wait they can expect.
+
+    The arrival rate is tracked from new requests, the service rate from claimed requests and ended conversations. Workers
+    ending conversations take the next case, so while users are waiting both drain the queue at about the same rate, and
+    the larger one is used. A new user at position n is expected to wait n / service rate. Users are admitted up to
+    warn_wait seconds of expected wait, warned up to max_wait and deferred beyond, so the queue stops growing at about
+    max_wait seconds of work instead of building up a backlog which never drains. Until min_samples claims have been
+    seen, the estimate is unknown and everybody is admitted."""
+
+    def __init__(self, tau=900, warn_wait=600, max_wait=3600, min_samples=5):
+        self.warn_wait = warn_wait
+        self.max_wait = max_wait
+        self.min_samples = min_samples
+        self.arrivals = RateEstimator(tau)
+        self.claims = RateEstimator(tau)
+        self.stops = RateEstimator(tau)
+        self._lock = threading.Lock()
+
+    def record_arrival(self):
+        with self._lock:
+            self.arrivals.record()
+
+    def record_claim(self):
+        with self._lock:
+            self.claims.record()
+
+    def record_stop(self):
+        with self._lock:
+            self.stops.record()
+
+    def arrival_rate(self):
+        with self._lock:
+            return self.arrivals.rate()
+
+    def service_rate(self):
+        with self._lock:
+            return max(self.claims.rate(), self.stops.rate())
+
+    def expected_wait(self, waiting):
+        """Returns the seconds a new user behind `waiting` users can expect to wait, or None while unknown"""
+        if waiting == 0:
+            return 0.0
+        if self.claims.events < self.min_samples:
+            return None
+        rate = self.service_rate()
+        if rate <= 0:
+            return float("inf")
+        return (waiting + 1) / rate
+
+    def decide(self, waiting):
+        """Returns the Admission of a new user behind `waiting` users and the expected wait in seconds or None"""
+        wait = self.expected_wait(waiting)
+        if wait is None or wait <= self.warn_wait:
+            return Admission.ADMIT, wait
+        if wait <= self.max_wait:
+            return Admission.WARN, wait
+        return Admission.DEFER, wait
+
+    def retry_after(self, wait):
+        """Returns the seconds after which a deferred user should try again, when the queue has drained below max_wait"""
+        if wait is None or math.isinf(wait):
+            return self.max_wait
+        return max(wait - self.max_wait, 60)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from telegram import InputMediaPhoto, InputMediaVideo, InputMediaDocument
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts between 2 and 10 items per media group
+MAX_ALBUM_SIZE = 10
+
+
+class _Album(object):
+
+    def __init__(self, media_group_id, bot, chat_id, prefix):
+        self.media_group_id = media_group_id
+        self.bot = bot
+        self.chat_id = chat_id
+        self.prefix = prefix
+        self.messages = []
+        self.job = None
+
+
+def send_media(bot, chat_id, message, caption=None):
+    """Relays a single photo, video or document by its file_id"""
+    if message.photo:
+        return bot.send_photo(chat_id=chat_id, photo=message.photo[-1].file_id, caption=caption)
+    if message.video:
+        return bot.send_video(chat_id=chat_id, video=message.video.file_id, caption=caption)
+    if message.document:
+        return bot.send_document(chat_id=chat_id, document=message.document.file_id, caption=caption)
+    logger.warning("Can't relay message {} as media".format(message.message_id))
+
+
+def input_media(message, caption=None):
+    if message.photo:
+        return InputMediaPhoto(media=message.photo[-1].file_id, caption=caption)
+    if message.video:
+        return InputMediaVideo(media=message.video.file_id, caption=caption)
+    if message.document:
+        return InputMediaDocument(media=message.document.file_id, caption=caption)
+    return None
+
+
+class AlbumCollector(object):
+    """Collects the items of an album (media group) relayed in a conversation and sends them with one send_media_group call.
+
+    Telegram delivers every item of an album as an update of its own. The items are collected until none arrived for
+    `delay` seconds or another message of the same conversation has to be relayed. Collecting and flushing happen on the
+    RelayExecutor worker of the conversation, so albums stay intact and in order with the other messages."""
+
+    def __init__(self, executor, delay=1.0):
+        self.executor = executor
+        self.delay = delay
+        self._albums = dict()
+
+    def __len__(self):
+        return len(self._albums)
+
+    def add(self, key, message, bot, chat_id, prefix, job_queue):
+        """Collects an album item to be sent to chat_id. Must be called on the executor worker responsible for key"""
+        album = self._albums.get(key)
+        if album is not None and album.media_group_id != message.media_group_id:
+            self.flush(key)
+            album = None
+        if album is None:
+            album = self._albums[key] = _Album(message.media_group_id, bot, chat_id, prefix)
+
+        album.messages.append(message)
+        # The timer restarts with every item, so the album is flushed once no more items arrive
+        if album.job is not None:
+            album.job.schedule_removal()
+        album.job = job_queue.run_once(self._expired, self.delay, context=(key, album))
+
+    def flush(self, key, media_group_id=None):
+        """Sends the collected album of a conversation, unless it's the album with media_group_id which is still being collected.
+
+        Must be called on the executor worker responsible for key."""
+        album = self._albums.get(key)
+        if album is None or (media_group_id is not None and album.media_group_id == media_group_id):
+            return
+
+        del self._albums[key]
+        if album.job is not None:
+            album.job.schedule_removal()
+        self._send(album)
+
+    def _expired(self, context):
+        key, album = context.job.context
+        self.executor.submit(key, self._flush_album, key, album)
+
+    def _flush_album(self, key, album):
+        if self._albums.get(key) is album:
+            self.flush(key)
+
+    @staticmethod
+    def _send(album):
+        messages = sorted(album.messages, key=lambda message: message.message_id)
+        for start in range(0, len(messages), MAX_ALBUM_SIZE):
+            chunk = messages[start:start + MAX_ALBUM_SIZE]
+            captions = [message.caption for message in chunk]
+            if start == 0:
+                captions[0] = album.prefix + (captions[0] or "")
+
+            if len(chunk) == 1:
+                send_media(album.bot, album.chat_id, chunk[0], captions[0])
+                continue
+
+            media = [input_media(message, caption) for message, caption in zip(chunk, captions)]
+            album.bot.send_media_group(chat_id=album.chat_id, media=[item for item in media if item is not None])
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from conversations import Conversations
+
+logger = logging.getLogger(__name__)
+
+
+class _Case(object):
+
+    def __init__(self, req, description=None, broadcast=False):
+        self.req = req
+        self.description = description
+        # True once the case has been posted to the room
+        self.broadcast = broadcast
+        self.declined = set()
+        # (worker_id, job) of the pending offer
+        self.offer = None
+
+
+class Assignments(object):
+    """Offers waiting requests to available workers and falls back to the room broadcast.
+
+    Workers announce that they are available for one ConversationType. Idle available workers wait in one heap per type
+    ordered by the number of cases they handled and the time they became idle, so the least-loaded worker is found in
+    O(log n). A case is offered to one worker at a time. If the worker declines or doesn't accept within `timeout`
+    seconds, the case is broadcast to the room as before. Whenever a worker becomes idle, the oldest waiting case of its
+    type is offered to it, including cases which have been broadcast already."""
+
+    def __init__(self, offer_callback, fallback_callback, expired_callback, timeout=30):
+        """offer_callback(context, worker_id, req, description) sends an offer, fallback_callback(context, req, description)
+        broadcasts a case to the room and expired_callback(context, worker_id, req) tells a worker that an offer expired"""
+        self.offer_callback = offer_callback
+        self.fallback_callback = fallback_callback
+        self.expired_callback = expired_callback
+        self.timeout = timeout
+        # worker_id -> ConversationType of all available workers
+        self._available = dict()
+        # ConversationType -> heap of [load, idle since, seq, worker_id, valid]
+        self._idle = dict()
+        self._entries = dict()
+        self._seq = itertools.count()
+        # user_id -> _Case of the waiting requests known to this process
+        self._cases = dict()
+        # worker_id -> user_id of the pending offers
+        self._offered = dict()
+        self._lock = threading.Lock()
+
+    def is_available(self, worker_id):
+        return worker_id in self._available
+
+    def count_idle(self, type=None):
+        with self._lock:
+            return sum(1 for entry in self._entries.values() if type is None or self._available[entry[3]] == type)
+
+    def set_available(self, worker_id, type):
+        """Marks a worker as available for cases of type. The worker gets offers once it's idle, see worker_idle()"""
+        with self._lock:
+            if self._available.get(worker_id) != type:
+                self._remove_idle(worker_id)
+            self._available[worker_id] = type
+
+    def set_away(self, context, worker_id):
+        """Stops offering cases to a worker. A pending offer is treated as declined"""
+        with self._lock:
+            self._available.pop(worker_id, None)
+            self._remove_idle(worker_id)
+        user_id = self._offered.get(worker_id)
+        if user_id is not None:
+            self.decline(context, worker_id, user_id)
+
+    def worker_idle(self, context, worker_id, load):
+        """Called when an available worker has no conversation (anymore), load is the number of cases it handled.
+
+        Offers the oldest waiting case of the worker's type to it, otherwise the worker waits for the next case."""
+        with self._lock:
+            type = self._available.get(worker_id)
+            if type is None or worker_id in self._offered:
+                return
+            case = self._next_case(type, worker_id)
+            if case is None:
+                self._add_idle(worker_id, type, load)
+                return
+            self._offer(context, worker_id, case)
+        self._send_offer(context, worker_id, case)
+
+    def offer(self, context, req, description):
+        """Offers a new request to the least-loaded idle worker of its type or broadcasts it if there is none"""
+        with self._lock:
+            case = self._cases[req.user.user_id] = _Case(req, description)
+            worker_id = self._pop_idle(req.type)
+            if worker_id is not None:
+                self._offer(context, worker_id, case)
+        if worker_id is None:
+            self._broadcast(context, case)
+        else:
+            self._send_offer(context, worker_id, case)
+
+    def is_offered(self, worker_id, user_id):
+        """Returns True if the case of user_id is currently offered to worker_id.
+
+        Accepting an offer means claiming the case, see claimed()."""
+        with self._lock:
+            return self._offered.get(worker_id) == user_id
+
+    def is_broadcast(self, user_id):
+        """Returns False while the case of user_id is offered to workers and hasn't been posted to the room yet"""
+        case = self._cases.get(user_id)
+        return case is None or case.broadcast
+
+    def get_description(self, user_id):
+        case = self._cases.get(user_id)
+        return None if case is None else case.description
+
+    def decline(self, context, worker_id, user_id):
+        """Withdraws the offer of a case to worker_id, broadcasts it unless that happened already and lets the worker
+        carry on with the next case"""
+        with self._lock:
+            if self._offered.get(worker_id) != user_id:
+                return False
+            case = self._withdraw(worker_id)
+            case.declined.add(worker_id)
+        if not case.broadcast:
+            self._broadcast(context, case)
+        return True
+
+    def claimed(self, user_id, worker_id=None):
+        """Forgets a case once it has been claimed by worker_id, or by anyone if None, and withdraws a pending offer of it.
+
+        Returns the id of another worker the case was offered to, that worker is idle again."""
+        with self._lock:
+            self._remove_idle(worker_id)
+            case = self._cases.get(user_id)
+            if case is None:
+                return None
+            offered_to = case.offer[0] if case.offer is not None else None
+            if offered_to is not None:
+                self._withdraw(offered_to)
+            del self._cases[user_id]
+        return offered_to if offered_to != worker_id else None
+
+    def _next_case(self, type, worker_id):
+        """Returns the oldest waiting case of type which isn't offered and hasn't been declined by the worker.
+
+        Only the line of type is searched, up to the first case which is neither offered nor declined by the worker."""
+
+        def is_offerable(req):
+            case = self._cases.get(req.user.user_id)
+            return case is None or (case.offer is None and worker_id not in case.declined)
+
+        found = Conversations().find_waiting_requests(type, is_offerable, limit=1)
+        if not found:
+            return None
+        req = found[0]
+        case = self._cases.get(req.user.user_id)
+        if case is None:
+            # Requested before a restart or via another process, these have been broadcast
+            case = self._cases[req.user.user_id] = _Case(req, broadcast=True)
+        return case
+
+    def _offer(self, context, worker_id, case):
+        """Records the offer of case to worker_id. Must be called with the lock held"""
+        user_id = case.req.user.user_id
+        job = context.job_queue.run_once(self._expired, self.timeout, context=(worker_id, user_id),
+                                         name="offer_{}".format(user_id))
+        case.offer = (worker_id, job)
+        self._offered[worker_id] = user_id
+
+    def _withdraw(self, worker_id):
+        """Removes the pending offer of worker_id and returns its case. Must be called with the lock held"""
+        user_id = self._offered.pop(worker_id)
+        case = self._cases.get(user_id)
+        if case is not None and case.offer is not None:
+            case.offer[1].schedule_removal()
+            case.offer = None
+        return case
+
+    def _send_offer(self, context, worker_id, case):
+        try:
+            self.offer_callback(context, worker_id, case.req, case.description)
+        except Exception:
+            logger.exception("Could not offer the case of user {} to worker {}".format(case.req.user.user_id, worker_id))
+            self.set_away(context, worker_id)
+
+    def _broadcast(self, context, case):
+        case.broadcast = True
+        try:
+            self.fallback_callback(context, case.req, case.description)
+        except Exception:
+            logger.exception("Could not broadcast the case of user {}".format(case.req.user.user_id))
+
+    def _expired(self, context):
+        worker_id, user_id = context.job.context
+        with self._lock:
+            case = self._cases.get(user_id)
+            if case is None or case.offer is None or case.offer[1] is not context.job:
+                return
+            self._withdraw(worker_id)
+            case.declined.add(worker_id)
+            # An unresponsive worker doesn't get any further offers
+            self._available.pop(worker_id, None)
+            self._remove_idle(worker_id)
+
+        try:
+            self.expired_callback(context, worker_id, case.req)
+        except Exception:
+            logger.exception("Could not tell worker {} that the offer expired".format(worker_id))
+        if not case.broadcast:
+            self._broadcast(context, case)
+
+    def _add_idle(self, worker_id, type, load):
+        self._remove_idle(worker_id)
+        entry = [load, time.monotonic(), next(self._seq), worker_id, True]
+        self._entries[worker_id] = entry
+        heapq.heappush(self._idle.setdefault(type, []), entry)
+
+    def _remove_idle(self, worker_id):
+        entry = self._entries.pop(worker_id, None)
+        if entry is not None:
+            # Removed lazily from the heap
+            entry[-1] = False
+
+    def _pop_idle(self, type):
+        heap = self._idle.get(type)
+        while heap:
+            entry = heapq.heappop(heap)
+            if entry[-1]:
+                del self._entries[entry[3]]
+                return entry[3]
+        return None
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+from .statebackend import StateBackend
+from .memorybackend import MemoryBackend
+from .sqlitebackend import SQLiteBackend
+
+__all__ = ["StateBackend", "MemoryBackend", "SQLiteBackend"]
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from conversation import Conversation
+from conversationrequest import ConversationRequest, ConversationType
+from conversationrequests import ConversationRequests
+from user import User
+
+from .statebackend import StateBackend
+
+
+class MemoryBackend(StateBackend):
+    """Keeps the state in the memory of the current process, optionally recording all changes in a Journal.
+
+    Every change holds one lock for checking and changing the state and journaling the change. All requests share the
+    lines of the queue, so finer grained locks per user wouldn't let two changes run at once anyway, and the changes only
+    take microseconds. Lookups of a single request or conversation are plain dict reads and don't take the lock."""
+
+    def __init__(self):
+        self.conversation_requests = ConversationRequests()
+        self.active_conversations = set()
+        # Maps the user_id of each participant (worker and user) to its Conversation
+        self._participants = dict()
+        self._journal = None
+        self._lock = threading.Lock()
+
+    def attach_journal(self, journal, state):
+        """Restores the requests and conversations from the state loaded from journal and records all further changes in it"""
+        # Looking the members up directly is a lot cheaper than calling ConversationType() for every record
+        types = {int(type): type for type in ConversationType}
+        requests = []
+        for user_id, (first_name, last_name, username, type, waiting_since) in state["request"].items():
+            req = ConversationRequest(User(user_id, first_name, last_name, username), types[type])
+            req.waiting_since = waiting_since
+            requests.append(req)
+        requests.sort(key=lambda req: req.waiting_since)
+        self.conversation_requests.extend(requests)
+
+        for user_id, (worker_id, type) in state["conversation"].items():
+            self._add_conversation(Conversation(User(worker_id), User(user_id), types[type]))
+
+        self._journal = journal
+
+    def _record(self, kind, key, value):
+        if self._journal is not None:
+            self._journal.append(kind, key, value)
+
+    def add_request(self, req):
+        user = req.user
+        with self._lock:
+            if user.user_id in self._participants or self.conversation_requests.has_user_request(user.user_id):
+                return False
+            self.conversation_requests.add(req)
+            self._record("request", user.user_id, (user.first_name, user.last_name, user.username, int(req.type), req.waiting_since))
+        return True
+
+    def get_request(self, user_id):
+        return self.conversation_requests.get_request_by_user(user_id)
+
+    def remove_request(self, user_id):
+        with self._lock:
+            if not self.conversation_requests.has_user_request(user_id):
+                return False
+            self.conversation_requests.close_by_user(user_id)
+            self._record("request", user_id, None)
+        return True
+
+    def get_request_position(self, user_id):
+        with self._lock:
+            return self.conversation_requests.get_position(user_id)
+
+    def count_requests(self, type=None):
+        if type is None:
+            return len(self.conversation_requests)
+        return self.conversation_requests.count(type)
+
+    def iter_requests(self):
+        with self._lock:
+            return self.conversation_requests.snapshot()
+
+    def find_requests(self, type, predicate=None, limit=None):
+        found = []
+        with self._lock:
+            for req in self.conversation_requests.iter_line(type):
+                if predicate is None or predicate(req):
+                    found.append(req)
+                    if len(found) == limit:
+                        break
+        return found
+
+    def get_oldest_request(self):
+        with self._lock:
+            return next(iter(self.conversation_requests), None)
+
+    def get_overdue_requests(self, deadline):
+        with self._lock:
+            return self.conversation_requests.get_overdue_requests(deadline)
+
+    def claim_request(self, worker_id, user_id):
+        with self._lock:
+            req = self.conversation_requests.get_request_by_user(user_id)
+            if req is None or worker_id in self._participants:
+                return None
+
+            conv = Conversation(User(worker_id), User(user_id), req.type)
+            self._add_conversation(conv)
+
+            self.conversation_requests.close(req)
+            self._record("request", user_id, None)
+            self._record("conversation", user_id, (worker_id, int(req.type)))
+        return conv
+
+    def _add_conversation(self, conv):
+        self.active_conversations.add(conv)
+        self._participants[conv.worker.user_id] = conv
+        self._participants[conv.user.user_id] = conv
+
+    def get_conversation(self, user_id):
+        return self._participants.get(user_id)
+
+    def remove_conversation(self, user_id):
+        with self._lock:
+            conv = self._participants.get(user_id)
+            if conv is None:
+                return None
+
+            self.active_conversations.discard(conv)
+            self._participants.pop(conv.worker.user_id, None)
+            self._participants.pop(conv.user.user_id, None)
+            self._record("conversation", conv.user.user_id, None)
+        return conv
+
+    def count_conversations(self):
+        return len(self.active_conversations)
+
+    def iter_conversations(self):
+        with self._lock:
+            return iter(list(self.active_conversations))
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+
+from conversation import Conversation
+from conversationrequest import ConversationRequest, ConversationType
+from user import User
+
+from .statebackend import StateBackend
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL UNIQUE,
+    first_name TEXT,
+    last_name TEXT,
+    username TEXT,
+    type INTEGER NOT NULL,
+    waiting_since INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_line ON requests (type, seq);
+CREATE INDEX IF NOT EXISTS requests_waiting_since ON requests (waiting_since);
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id INTEGER PRIMARY KEY,
+    worker_id INTEGER NOT NULL UNIQUE,
+    type INTEGER NOT NULL
+);
+"""
+
+
+class SQLiteBackend(StateBackend):
+    """Keeps the state in a SQLite database in WAL mode, which can be shared by several bot processes on the same host.
+
+    Claiming a request runs in one write transaction, so when several processes race for the same case exactly one of
+    them gets it. Every thread uses its own connection."""
+
+    def __init__(self, path, timeout=10):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._types = {int(type): type for type in ConversationType}
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _request(self, row):
+        user_id, first_name, last_name, username, type, waiting_since = row
+        req = ConversationRequest(User(user_id, first_name, last_name, username), self._types[type])
+        req.waiting_since = waiting_since
+        return req
+
+    def _conversation(self, row):
+        user_id, worker_id, type = row
+        return Conversation(User(worker_id), User(user_id), self._types[type])
+
+    def add_request(self, req):
+        user = req.user
+        # The unique user_id ignores a second request, the condition users taking part in a conversation
+        cursor = self._db().execute("INSERT OR IGNORE INTO requests (user_id, first_name, last_name, username, type, waiting_since) "
+                                    "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS "
+                                    "(SELECT 1 FROM conversations WHERE user_id = ? OR worker_id = ?)",
+                                    (user.user_id, user.first_name, user.last_name, user.username, int(req.type), req.waiting_since,
+                                     user.user_id, user.user_id))
+        return cursor.rowcount > 0
+
+    def get_request(self, user_id):
+        row = self._db().execute("SELECT user_id, first_name, last_name, username, type, waiting_since FROM requests "
+                                 "WHERE user_id = ?", (user_id,)).fetchone()
+        return None if row is None else self._request(row)
+
+    def remove_request(self, user_id):
+        return self._db().execute("DELETE FROM requests WHERE user_id = ?", (user_id,)).rowcount > 0
+
+    def get_request_position(self, user_id):
+        row = self._db().execute("SELECT COUNT(*) FROM requests AS r, (SELECT type, seq FROM requests WHERE user_id = ?) AS own "
+                                 "WHERE r.type = own.type AND r.seq <= own.seq", (user_id,)).fetchone()
+        return row[0] or None
+
+    def count_requests(self, type=None):
+        if type is None:
+            return self._db().execute("SELECT COUNT(*) FROM requests").fetchone()[0]
+        return self._db().execute("SELECT COUNT(*) FROM requests WHERE type = ?", (int(type),)).fetchone()[0]
+
+    def iter_requests(self):
+        rows = self._db().execute("SELECT user_id, first_name, last_name, username, type, waiting_since FROM requests "
+                                  "ORDER BY waiting_since, seq").fetchall()
+        return (self._request(row) for row in rows)
+
+    def find_requests(self, type, predicate=None, limit=None):
+        # The rows are fetched from the cursor as they are needed, so the search stops reading the line at limit matches
+        cursor = self._db().execute("SELECT user_id, first_name, last_name, username, type, waiting_since FROM requests "
+                                    "WHERE type = ? ORDER BY seq", (int(type),))
+        found = []
+        for row in cursor:
+            req = self._request(row)
+            if predicate is None or predicate(req):
+                found.append(req)
+                if len(found) == limit:
+                    break
+        cursor.close()
+        return found
+
+    def get_oldest_request(self):
+        row = self._db().execute("SELECT user_id, first_name, last_name, username, type, waiting_since FROM requests "
+                                 "ORDER BY waiting_since, seq LIMIT 1").fetchone()
+        return None if row is None else self._request(row)
+
+    def get_overdue_requests(self, deadline):
+        rows = self._db().execute("SELECT user_id, first_name, last_name, username, type, waiting_since FROM requests "
+                                  "WHERE waiting_since <= ? ORDER BY waiting_since, seq", (deadline,)).fetchall()
+        return [self._request(row) for row in rows]
+
+    def claim_request(self, worker_id, user_id):
+        if worker_id == user_id:
+            raise ValueError("Worker can't be the same as user")
+
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT type FROM requests WHERE user_id = ?", (user_id,)).fetchone()
+            busy = db.execute("SELECT 1 FROM conversations WHERE user_id = ? OR worker_id = ?", (worker_id, worker_id)).fetchone()
+            if row is None or busy is not None:
+                db.execute("ROLLBACK")
+                return None
+
+            db.execute("DELETE FROM requests WHERE user_id = ?", (user_id,))
+            db.execute("INSERT INTO conversations (user_id, worker_id, type) VALUES (?, ?, ?)", (user_id, worker_id, row[0]))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return self._conversation((user_id, worker_id, row[0]))
+
+    def get_conversation(self, user_id):
+        row = self._db().execute("SELECT user_id, worker_id, type FROM conversations WHERE user_id = ? "
+                                 "UNION ALL SELECT user_id, worker_id, type FROM conversations WHERE worker_id = ?",
+                                 (user_id, user_id)).fetchone()
+        return None if row is None else self._conversation(row)
+
+    def remove_conversation(self, user_id):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT user_id, worker_id, type FROM conversations WHERE user_id = ? OR worker_id = ?",
+                             (user_id, user_id)).fetchone()
+            if row is not None:
+                db.execute("DELETE FROM conversations WHERE user_id = ?", (row[0],))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return None if row is None else self._conversation(row)
+
+    def count_conversations(self):
+        return self._db().execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def iter_conversations(self):
+        rows = self._db().execute("SELECT user_id, worker_id, type FROM conversations").fetchall()
+        return (self._conversation(row) for row in rows)
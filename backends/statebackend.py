@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from abc import ABC, abstractmethod
+
+
+class StateBackend(ABC):
+    """Storage of the waiting ConversationRequests and the active Conversations used by Conversations.
+
+    A participant is either waiting with one request, taking part in one conversation or unknown to the backend. Every
+    method is atomic, the backend may be used by several threads and checks nothing the caller has to check again."""
+
+    @abstractmethod
+    def add_request(self, req):
+        """Adds a waiting request unless the user is already waiting or taking part in a conversation.
+
+        Returns True if the request has been added."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_request(self, user_id):
+        """Returns the waiting request of a user or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_request(self, user_id):
+        """Removes the waiting request of a user, returns True if there was one"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_request_position(self, user_id):
+        """Returns the 1-based position of a waiting user among the requests of the same type or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_requests(self, type=None):
+        """Counts the waiting requests, of one ConversationType if type is given"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_requests(self):
+        """Iterates over all waiting requests, oldest first. The requests may have changed by the time they are iterated"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_requests(self, type, predicate=None, limit=None):
+        """Returns up to limit waiting requests of type for which predicate(req) is true, oldest first.
+
+        Only the line of type is searched and the search stops at limit matches. The predicate may be called while the
+        backend is locked and must not use the backend."""
+        raise NotImplementedError
+
+    def get_oldest_request(self):
+        """Returns the request waiting the longest or None"""
+        return next(iter(self.iter_requests()), None)
+
+    @abstractmethod
+    def get_overdue_requests(self, deadline):
+        """Returns the requests waiting since deadline (a unix timestamp) or earlier, oldest first"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim_request(self, worker_id, user_id):
+        """Atomically turns the waiting request of user_id into a Conversation with worker_id.
+
+        Returns the new Conversation, or None if the user isn't waiting (anymore) or the worker is already in a conversation."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_conversation(self, user_id):
+        """Returns the Conversation a worker or user takes part in or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_conversation(self, user_id):
+        """Removes the Conversation a worker or user takes part in and returns it, or None if there was none"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_conversations(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_conversations(self):
+        """Iterates over all active Conversations"""
+        raise NotImplementedError
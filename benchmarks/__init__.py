@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the bot's hot paths against an in-process fake Bot.
+
+Run all of them with `python -m benchmarks` from the project root, or a single one with e.g. `python -m benchmarks.pipeline`.
+Every benchmark prints its results as JSON, so that runs of different commits can be compared."""
+import os
+
+# Benchmarks must never touch the journal of a real deployment, settings are read after this
+os.environ["JOURNAL_PATH"] = ""
+# The rooms the fake Bot "sends" case notifications to
+os.environ.setdefault("TELEGRAM_DOCTOR_ROOM", "-1001")
+os.environ.setdefault("TELEGRAM_PSYCHOLOGIST_ROOM", "-1002")
+os.environ.setdefault("TELEGRAM_NEW_MEMBERS_ROOM", "-1003")
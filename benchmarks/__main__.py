@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Runs all benchmarks, each in a fresh process, and optionally compares the results with an earlier run"""
+import argparse
+import json
+import subprocess
+import sys
+
+BENCHMARKS = ["pipeline", "registry", "relay", "ingest", "journal", "logging_overhead", "routing", "memory", "soak", "claims", "albums"]
+# Relative change of a metric which is reported as regression or improvement
+THRESHOLD = 0.10
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(value, prefix=""):
+    """Yields (path, number) for all numbers in nested dicts"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, "{}.{}".format(prefix, key) if prefix else str(key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def higher_is_better(path):
+    return path.endswith("per_second") or path.endswith("throughput")
+
+
+def compare(baseline, current):
+    """Returns the metrics which changed by more than THRESHOLD as list of (path, old, new, verdict)"""
+    old_metrics = dict(flatten(baseline))
+    changes = []
+    for path, new in flatten(current):
+        leaf = path.rsplit(".", 1)[-1]
+        # Maxima are single samples and far too noisy to compare
+        compared = leaf.endswith("_ms") or leaf.endswith("seconds") or leaf.startswith("bytes_") or leaf == "max_rss_mb"
+        if leaf == "max_ms" or not (compared or higher_is_better(leaf)):
+            continue
+        old = old_metrics.get(path)
+        if not old:
+            continue
+        change = (new - old) / old
+        if abs(change) <= THRESHOLD:
+            continue
+        better = change > 0 if higher_is_better(leaf) else change < 0
+        changes.append((path, old, new, "improved" if better else "REGRESSED"))
+    return changes
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("benchmarks", nargs="*", default=BENCHMARKS, help="Benchmarks to run, all by default")
+    argument_parser.add_argument("--output", help="Write the combined JSON results to this file")
+    argument_parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    args = argument_parser.parse_args()
+
+    report = {"commit": git_commit(), "benchmarks": dict()}
+    for name in args.benchmarks:
+        print("Running {}...".format(name), file=sys.stderr)
+        output = subprocess.check_output([sys.executable, "-m", "benchmarks.{}".format(name)])
+        report["benchmarks"][name] = json.loads(output.decode("utf-8"))
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        changes = compare(baseline["benchmarks"], report["benchmarks"])
+        for path, old, new, verdict in changes:
+            print("{:<10} {}: {:.4g} -> {:.4g}".format(verdict, path, old, new), file=sys.stderr)
+        if not changes:
+            print("No metric changed by more than {:.0%}".format(THRESHOLD), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
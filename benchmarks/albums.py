@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Relays two albums with a text message in between and checks that they arrive intact and in order"""
+import threading
+import time
+
+from backends import MemoryBackend
+from benchmarks.fakebot import FakeBot
+from benchmarks.harness import build_dispatcher, emit, parser
+from benchmarks.registry import PATIENT_IDS, WORKER_IDS, populate
+from benchmarks.updates import UpdateFactory
+from conversations import Conversations
+
+
+def file_ids(media):
+    return [item.media if hasattr(item, "media") else item["media"] for item in media]
+
+
+def check(delay, workers, first_size=3, second_size=2):
+    """The patient sends an album, a text message and another album, which the worker has to receive as send_media_group,
+    send_message and send_media_group with the original file_ids. The first album has to be sent as soon as the text
+    message arrives and the second one once no further item arrived for `delay` seconds.
+
+    Raises an AssertionError otherwise, returns the seconds until each album was sent."""
+    import bot as bot_module
+
+    bot = FakeBot()
+    dispatcher, _ = build_dispatcher(bot)
+    factory = UpdateFactory(bot)
+    populate(Conversations(), 1)
+
+    calls = []
+    done = threading.Event()
+
+    def on_call(method, data):
+        if str(data.get("chat_id")) != str(WORKER_IDS):
+            return
+        calls.append((time.perf_counter(), method, data))
+        if len(calls) == 3:
+            done.set()
+
+    bot._request.on_call = on_call
+    bot_module.albums.delay = delay
+    executor = bot_module.relay_executor
+    executor.workers = workers
+    executor.start()
+    dispatcher.job_queue.start()
+    try:
+        first = [factory.photo(PATIENT_IDS, media_group_id="first") for _ in range(first_size)]
+        second = [factory.photo(PATIENT_IDS, media_group_id="second") for _ in range(second_size)]
+        for update in first:
+            dispatcher.process_update(update)
+        text_at = time.perf_counter()
+        dispatcher.process_update(factory.message(PATIENT_IDS, "Between the albums"))
+        for update in second:
+            dispatcher.process_update(update)
+        last_item_at = time.perf_counter()
+        assert done.wait(timeout=delay + 10), "sent {} of 3 messages".format(len(calls))
+    finally:
+        dispatcher.job_queue.stop()
+        executor.stop()
+        bot_module.albums.delay = bot_module.settings.ALBUM_COLLECT_DELAY
+
+    assert [method for _, method, _ in calls] == ["sendMediaGroup", "sendMessage", "sendMediaGroup"], calls
+    for (_, _, data), album in ((calls[0], first), (calls[2], second)):
+        assert file_ids(data["media"]) == [update.message.photo[-1].file_id for update in album], data["media"]
+    assert calls[1][2]["text"].endswith("Between the albums")
+
+    # The text message flushes the first album, the second one is flushed by the timer
+    first_seconds = calls[0][0] - text_at
+    second_seconds = calls[2][0] - last_item_at
+    assert first_seconds < delay, "first album sent after {:.3f}s".format(first_seconds)
+    assert second_seconds >= delay, "second album sent after {:.3f}s".format(second_seconds)
+    return {
+        "flushed_by_message_seconds": first_seconds,
+        "flushed_by_timer_seconds": second_seconds,
+    }
+
+
+def run(delay, workers):
+    results = dict()
+    for number in workers:
+        results[str(number)] = check(delay, number)
+    Conversations().use_backend(MemoryBackend())
+    return results
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--delay", type=float, default=0.5, help="ALBUM_COLLECT_DELAY in seconds")
+    argument_parser.add_argument("--workers", default="0,8", help="Comma separated numbers of relay workers to check")
+    args = argument_parser.parse_args()
+    params = {"delay": args.delay, "workers": [int(number) for number in args.workers.split(",")]}
+    emit("albums", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Races threads requesting, claiming and stopping the same cases and checks that every case is assigned exactly once"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from backends import MemoryBackend, SQLiteBackend
+from benchmarks.harness import emit, parser
+from benchmarks.registry import PATIENT_IDS, WORKER_IDS
+from conversationrequest import ConversationType
+from conversations import Conversations
+
+
+def race(threads, target):
+    """Runs target(number) on `threads` threads started at the same time, returns the seconds until all finished"""
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def run(number):
+        barrier.wait()
+        try:
+            target(number)
+        except Exception as e:
+            errors.append(e)
+
+    pool = [threading.Thread(target=run, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - start
+
+
+def check(backend, threads, cases):
+    """Every thread requests all cases, then every thread claims cases as its own worker while other threads stop the
+    conversations from the patients' side. Raises an AssertionError if any case is requested, claimed or stopped other
+    than exactly once"""
+    conversations = Conversations()
+    conversations.use_backend(backend)
+    patients = [PATIENT_IDS + number for number in range(cases)]
+    requested = Counter()
+    claimed = Counter()
+    stopped = Counter()
+    lock = threading.Lock()
+
+    def request(number):
+        for patient_id in random.sample(patients, len(patients)):
+            req = conversations.request_conversation(patient_id, "Patient", None, None, ConversationType(patient_id % 2 + 1))
+            if req is not None:
+                with lock:
+                    requested[patient_id] += 1
+
+    def claim_and_stop(number):
+        # Even threads are workers, odd threads stop the conversations of the patients
+        worker_id = WORKER_IDS + number
+        for patient_id in random.sample(patients, len(patients)):
+            if number % 2 == 0:
+                conversation = conversations.new_conversation(worker_id, patient_id)
+                if conversation is None:
+                    continue
+                with lock:
+                    claimed[patient_id] += 1
+                stopper = worker_id
+            else:
+                stopper = patient_id
+            conversation = conversations.stop_conversation(stopper)
+            if conversation is not None:
+                with lock:
+                    stopped[conversation.user.user_id] += 1
+
+    request_seconds = race(threads, request)
+    assert sorted(requested) == patients and set(requested.values()) == {1}, "requested more than once"
+    assert conversations.count_waiting_requests() == cases
+
+    claim_seconds = race(max(2, threads), claim_and_stop)
+    assert sorted(claimed) == patients and set(claimed.values()) == {1}, "claimed more than once or not at all"
+    assert sorted(stopped) == patients and set(stopped.values()) == {1}, "stopped more than once or not at all"
+    assert conversations.count_waiting_requests() == 0 and conversations.count_active_conversations() == 0
+
+    return {
+        "requests_per_second": threads * cases / request_seconds,
+        "claims_per_second": cases / claim_seconds,
+    }
+
+
+def run(threads, cases, switch_interval):
+    # Switching threads more often than the default 5ms makes the threads interleave within the operations
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(switch_interval)
+    directory = tempfile.mkdtemp()
+    try:
+        return {
+            "memory": check(MemoryBackend(), threads, cases),
+            "sqlite": check(SQLiteBackend(os.path.join(directory, "state.sqlite3")), threads, cases),
+        }
+    finally:
+        sys.setswitchinterval(interval)
+        Conversations().use_backend(MemoryBackend())
+        shutil.rmtree(directory)
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--threads", type=int, default=8)
+    argument_parser.add_argument("--cases", type=int, default=2000)
+    argument_parser.add_argument("--switch-interval", type=float, default=1e-6, help="sys.setswitchinterval() while racing")
+    args = argument_parser.parse_args()
+    params = {"threads": args.threads, "cases": args.cases, "switch_interval": args.switch_interval}
+    emit("claims", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import itertools
+import threading
+import time
+from collections import Counter
+
+from telegram import Bot
+
+BOT_ID = 123456
+BOT_USERNAME = "benchmark_bot"
+
+
+class FakeRequest(object):
+    """Stands in for telegram.utils.request.Request and answers every Bot API call in process.
+
+    Each call sleeps for `latency` seconds to emulate the round trip to Telegram. Methods can be answered by custom callables
+    registered in `handlers`, e.g. to feed getUpdates."""
+
+    def __init__(self, latency=0.0, con_pool_size=64):
+        self.latency = latency
+        self.con_pool_size = con_pool_size
+        self.calls = Counter()
+        self.handlers = dict()
+        # Called as on_call(method, data) after the emulated round trip, e.g. to take timestamps
+        self.on_call = None
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _message(self, chat_id):
+        chat_id = int(chat_id)
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark", "username": BOT_USERNAME},
+        }
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit("/", 1)[-1]
+        with self._lock:
+            self.calls[method] += 1
+
+        handler = self.handlers.get(method)
+        if handler is not None:
+            return handler(data)
+
+        if self.latency:
+            time.sleep(self.latency)
+        if self.on_call is not None:
+            self.on_call(method, data)
+
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark", "username": BOT_USERNAME}
+        if method == "getMyCommands":
+            return []
+        if method == "sendMediaGroup":
+            return [self._message(data["chat_id"]) for _ in data["media"]]
+        if method.startswith("send") or method.startswith("edit") or method == "forwardMessage":
+            return self._message(data["chat_id"])
+        return True
+
+    def get(self, url, timeout=None):
+        return self.post(url, dict(), timeout)
+
+    def stop(self):
+        pass
+
+
+class FakeBot(Bot):
+    """Bot whose requests never leave the process, see FakeRequest"""
+
+    def __init__(self, latency=0.0):
+        super(FakeBot, self).__init__("{}:benchmark".format(BOT_ID), request=FakeRequest(latency))
+
+    @property
+    def calls(self):
+        return self._request.calls
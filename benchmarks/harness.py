@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import platform
+import resource
+import sys
+from collections import defaultdict
+from queue import Queue
+
+from telegram.ext import Dispatcher, JobQueue
+
+from metrics import instrument_handlers
+
+
+def percentiles(samples):
+    """Returns count, mean and the usual percentiles of a list of durations in seconds, reported in milliseconds"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    def pick(fraction):
+        return ordered[min(count - 1, int(fraction * count))] * 1000
+
+    return {
+        "count": count,
+        "mean_ms": sum(ordered) / count * 1000,
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def max_rss_mb():
+    """Peak resident memory of this process"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def build_dispatcher(bot):
+    """Builds a dispatcher with the handlers registered by bot.main(), returns it with the per-handler timings"""
+    import bot as bot_module
+
+    job_queue = JobQueue()
+    dispatcher = Dispatcher(bot, Queue(), job_queue=job_queue, use_context=True)
+    job_queue.set_dispatcher(dispatcher)
+    bot_module.bot_identity.refresh(bot)
+    # The benchmarks send far more messages per user than a person could
+    bot_module.throttle.limits.clear()
+    bot_module.bound_context_data(dispatcher)
+    bot_module.register_handlers(dispatcher)
+    return dispatcher, instrument(dispatcher)
+
+
+def instrument(dispatcher):
+    """Wraps the callbacks of all registered handlers and returns a dict callback name -> list of durations"""
+    timings = defaultdict(list)
+    instrument_handlers(dispatcher, lambda name, seconds: timings[name].append(seconds))
+    return timings
+
+
+def parser(description):
+    argument_parser = argparse.ArgumentParser(description=description)
+    argument_parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    return argument_parser
+
+
+def emit(name, params, results, output=None):
+    """Prints (or writes) the results of a benchmark as JSON"""
+    report = {
+        "benchmark": name,
+        "python": platform.python_version(),
+        "params": params,
+        "results": results,
+        "max_rss_mb": max_rss_mb(),
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return report
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Compares the delay between Telegram receiving an update and the bot dispatching it, for long polling and the webhook"""
+import json
+import socket
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
+from telegram import Update
+from telegram.ext import TypeHandler, Updater
+
+from backends import MemoryBackend
+from benchmarks.fakebot import FakeBot
+from benchmarks.harness import build_dispatcher, emit, parser, percentiles
+from benchmarks.registry import PATIENT_IDS, WORKER_IDS, populate
+from benchmarks.updates import UpdateFactory
+from config import settings
+from conversations import Conversations
+
+
+class FakeTelegram(object):
+    """Holds the updates Telegram would deliver and answers getUpdates like the long polling endpoint"""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.pending = []
+        self._cond = threading.Condition()
+
+    def publish(self, update_json):
+        with self._cond:
+            self.pending.append(update_json)
+            self._cond.notify_all()
+
+    def get_updates(self, data):
+        time.sleep(self.rtt / 2)
+        offset = data.get("offset") or 0
+        deadline = time.monotonic() + data.get("timeout", 0)
+        with self._cond:
+            self.pending = [update for update in self.pending if update["update_id"] >= offset]
+            while not self.pending and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            batch = self.pending[:data.get("limit") or 100]
+        time.sleep(self.rtt / 2)
+        return batch
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_once(mode, rate, duration, rtt, conversations):
+    bot = FakeBot()
+    dispatcher, _ = build_dispatcher(bot)
+    dispatcher.update_queue = Queue(maxsize=settings.UPDATE_QUEUE_SIZE)
+    factory = UpdateFactory(bot)
+    populate(Conversations(), conversations)
+
+    count = int(rate * duration)
+    updates = [factory.to_json(factory.message((PATIENT_IDS if number % 2 else WORKER_IDS) + number % conversations,
+                                               "Message {}".format(number))) for number in range(count)]
+    arrivals = dict()
+    latencies = []
+    done = threading.Event()
+
+    def received(update, context):
+        latencies.append(time.perf_counter() - arrivals[update.update_id])
+        if len(latencies) == count:
+            done.set()
+
+    dispatcher.add_handler(TypeHandler(Update, received), group=-1)
+    updater = Updater(dispatcher=dispatcher, workers=None, use_context=True)
+    telegram = FakeTelegram(rtt)
+    senders = None
+
+    if mode == "polling":
+        bot._request.handlers["getUpdates"] = telegram.get_updates
+        updater.start_polling(poll_interval=0, timeout=1)
+        deliver = telegram.publish
+    else:
+        port = free_port()
+        updater.start_webhook(listen="127.0.0.1", port=port, url_path="webhook")
+        url = "http://127.0.0.1:{}/webhook".format(port)
+        # Telegram pushes updates over up to WEBHOOK_MAX_CONNECTIONS parallel connections
+        senders = ThreadPoolExecutor(settings.WEBHOOK_MAX_CONNECTIONS)
+
+        def post(update_json):
+            time.sleep(rtt / 2)
+            request = urllib.request.Request(url, json.dumps(update_json).encode("utf-8"),
+                                             {"Content-Type": "application/json"})
+            urllib.request.urlopen(request).read()
+
+        def deliver(update_json):
+            senders.submit(post, update_json)
+        # Give the webhook server a moment to start listening
+        time.sleep(0.5)
+
+    start = time.perf_counter()
+    for number, update_json in enumerate(updates):
+        arrival = start + number / rate
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        arrivals[update_json["update_id"]] = arrival
+        deliver(update_json)
+    done.wait(timeout=60)
+    elapsed = time.perf_counter() - start
+
+    if senders is not None:
+        senders.shutdown()
+    updater.stop()
+
+    result = percentiles(latencies)
+    result["throughput"] = len(latencies) / elapsed
+    result["lost"] = count - len(latencies)
+    result["get_updates_calls"] = bot.calls["getUpdates"]
+    return result
+
+
+def run(modes, rate, duration, rtt, conversations):
+    results = dict()
+    for mode in modes:
+        results[mode] = run_once(mode, rate, duration, rtt, conversations)
+    Conversations().use_backend(MemoryBackend())
+    return results
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--modes", default="polling,webhook")
+    argument_parser.add_argument("--rate", type=float, default=200, help="Incoming updates per second")
+    argument_parser.add_argument("--duration", type=float, default=5, help="Seconds of incoming updates")
+    argument_parser.add_argument("--rtt", type=float, default=0.05, help="Round trip time to Telegram in seconds")
+    argument_parser.add_argument("--conversations", type=int, default=1000)
+    args = argument_parser.parse_args()
+    params = {
+        "modes": args.modes.split(","),
+        "rate": args.rate,
+        "duration": args.duration,
+        "rtt": args.rtt,
+        "conversations": args.conversations,
+    }
+    emit("ingest", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    main()
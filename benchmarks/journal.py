@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Measures what journaling costs on the write path and how long restoring a large state takes"""
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+from backends import MemoryBackend
+from benchmarks.harness import emit, parser, percentiles
+from benchmarks.registry import PATIENT_IDS, WORKER_IDS
+from conversationrequest import ConversationRequest, ConversationType
+from journal import Journal
+from user import User
+
+
+def lifecycle(backend, cases):
+    """Requests, claims and stops `cases` conversations and returns the duration of each state change"""
+    samples = []
+    for number in range(cases):
+        user_id = PATIENT_IDS + number
+        req = ConversationRequest(User(user_id, "Patient", None, "patient{}".format(number)), ConversationType.MEDICAL)
+        for change in (lambda: backend.add_request(req),
+                       lambda: backend.claim_request(WORKER_IDS + number, user_id),
+                       lambda: backend.remove_conversation(user_id)):
+            start = time.perf_counter()
+            change()
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run(cases, records, directory):
+    results = dict()
+
+    results["memory"] = percentiles(lifecycle(MemoryBackend(), cases))
+
+    journal = Journal(os.path.join(directory, "lifecycle.sqlite3"))
+    backend = MemoryBackend()
+    backend.attach_journal(journal, defaultdict(dict))
+    results["journaled"] = percentiles(lifecycle(backend, cases))
+    journal.close()
+
+    # A large state: records waiting requests, a tenth of them in conversations
+    journal = Journal(os.path.join(directory, "restore.sqlite3"))
+    backend = MemoryBackend()
+    backend.attach_journal(journal, defaultdict(dict))
+    for number in range(records):
+        user = User(PATIENT_IDS + number, "Patient", None, "patient{}".format(number))
+        backend.add_request(ConversationRequest(user, ConversationType(number % 2 + 1)))
+    for number in range(0, records, 10):
+        backend.claim_request(WORKER_IDS + number, PATIENT_IDS + number)
+
+    start = time.perf_counter()
+    journal.compact()
+    results["compact_seconds"] = time.perf_counter() - start
+    journal.close()
+
+    start = time.perf_counter()
+    journal = Journal(os.path.join(directory, "restore.sqlite3"))
+    state = journal.load()
+    loaded = time.perf_counter()
+    restored = MemoryBackend()
+    restored.attach_journal(journal, state)
+    finished = time.perf_counter()
+    journal.close()
+
+    results["restore"] = {
+        "load_seconds": loaded - start,
+        "attach_seconds": finished - loaded,
+        "total_seconds": finished - start,
+        "requests": restored.count_requests(),
+        "conversations": restored.count_conversations(),
+    }
+    return results
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--cases", type=int, default=5000, help="Conversations to run through on the write path")
+    argument_parser.add_argument("--records", type=int, default=100000, help="Requests in the state to restore")
+    args = argument_parser.parse_args()
+    params = {"cases": args.cases, "records": args.records}
+    directory = tempfile.mkdtemp(prefix="benchmark-journal-")
+    try:
+        emit("journal", params, run(directory=directory, **params), args.output)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Compares the relay throughput without logging, with a file handler on the relay thread and with the queued logging pipeline"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from backends import MemoryBackend
+from benchmarks.fakebot import FakeBot
+from benchmarks.harness import build_dispatcher, emit, parser, percentiles
+from benchmarks.registry import PATIENT_IDS, WORKER_IDS, populate
+from benchmarks.updates import UpdateFactory
+from config import settings
+from conversations import Conversations
+from logpipeline import setup_logging
+
+VARIANTS = ["off", "sync", "queued"]
+
+
+def stall_handlers(handlers, stall):
+    """Makes every write of the handlers take `stall` seconds longer, like a busy disk"""
+    for handler in handlers:
+        emit_record = handler.emit
+
+        def stalled(record, emit_record=emit_record):
+            time.sleep(stall)
+            emit_record(record)
+
+        handler.emit = stalled
+
+
+def configure(variant, directory, stall):
+    """Sets up logging as in the variant and returns a function tearing it down again"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    relay_logger = logging.getLogger("bot.relay")
+    for log_filter in list(relay_logger.filters):
+        relay_logger.removeFilter(log_filter)
+
+    if variant == "off":
+        root.setLevel(logging.CRITICAL)
+        relay_logger.setLevel(logging.CRITICAL)
+        return lambda: None
+
+    if variant == "sync":
+        # Like before the logging pipeline: the relay thread writes every record itself
+        handler = logging.FileHandler(os.path.join(directory, "sync.log"), "a", "utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        stall_handlers([handler], stall)
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        relay_logger.setLevel(logging.DEBUG)
+        return handler.close
+
+    with open(settings.LOGGER_CONFIG) as f:
+        config = yaml.safe_load(f)
+    config["root"]["handlers"] = ["file"]
+    config["handlers"]["file"]["filename"] = os.path.join(directory, "queued.log")
+    config["loggers"]["bot.relay"]["level"] = "DEBUG"
+    config_path = os.path.join(directory, "logger.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    listener = setup_logging(config_path, settings.LOG_QUEUE_SIZE)
+    stall_handlers(listener.handlers, stall)
+    return listener.stop
+
+
+def run_variant(variant, directory, stall, conversations, messages):
+    bot = FakeBot()
+    dispatcher, _ = build_dispatcher(bot)
+    factory = UpdateFactory(bot)
+    populate(Conversations(), conversations)
+    updates = [factory.message((PATIENT_IDS if number % 2 else WORKER_IDS) + number % conversations, "Message {}".format(number))
+               for number in range(messages)]
+
+    teardown = configure(variant, directory, stall)
+    durations = []
+    start = time.perf_counter()
+    for update in updates:
+        update_start = time.perf_counter()
+        dispatcher.process_update(update)
+        durations.append(time.perf_counter() - update_start)
+    elapsed = time.perf_counter() - start
+    teardown()
+
+    result = percentiles(durations)
+    result["updates_per_second"] = messages / elapsed
+    return result
+
+
+def run(stalls, conversations, messages, directory):
+    results = dict()
+    for stall in stalls:
+        for variant in VARIANTS:
+            if variant == "off" and stall:
+                continue
+            name = variant if not stall else "{}_stall_{}ms".format(variant, stall * 1000)
+            results[name] = run_variant(variant, directory, stall, conversations, messages)
+    Conversations().use_backend(MemoryBackend())
+    return results
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--stalls", default="0,0.002", help="Comma separated extra seconds per written record")
+    argument_parser.add_argument("--conversations", type=int, default=1000)
+    argument_parser.add_argument("--messages", type=int, default=5000)
+    args = argument_parser.parse_args()
+    params = {
+        "stalls": [float(stall) for stall in args.stalls.split(",")],
+        "conversations": args.conversations,
+        "messages": args.messages,
+    }
+    directory = tempfile.mkdtemp(prefix="benchmark-logging-")
+    try:
+        emit("logging_overhead", params, run(directory=directory, **params), args.output)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Measures the memory held per waiting request and per active conversation and checks the queue against a naive model"""
+import gc
+import random
+import time
+import tracemalloc
+
+from backends import MemoryBackend
+from benchmarks.harness import emit, parser
+from benchmarks.registry import PATIENT_IDS, WORKER_IDS
+from conversationrequest import ConversationRequest, ConversationType
+from user import User
+
+
+def request(number):
+    user = User(PATIENT_IDS + number, "Patient{}".format(number), None, "patient{}".format(number))
+    return ConversationRequest(user, ConversationType(number % 2 + 1))
+
+
+def measure(size):
+    """Returns the bytes allocated per waiting request and per active conversation with `size` entries, half of each"""
+    gc.collect()
+    tracemalloc.start()
+    backend = MemoryBackend()
+    for number in range(size):
+        backend.add_request(request(number))
+    requests_bytes = tracemalloc.get_traced_memory()[0]
+
+    # Claiming every second request turns half of them into conversations
+    for number in range(0, size, 2):
+        backend.claim_request(WORKER_IDS + number, PATIENT_IDS + number)
+    gc.collect()
+    total_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    per_request = requests_bytes / size
+    conversations = size // 2
+    return {
+        "bytes_per_waiting_request": per_request,
+        "bytes_per_active_conversation": (total_bytes - per_request * (size - conversations)) / conversations,
+        "total_mb": total_bytes / (1024 * 1024),
+    }
+
+
+def check(operations, seed=1):
+    """Runs random operations against the MemoryBackend and a naive list based model of the queue and the conversations.
+
+    Raises an AssertionError at the first difference, returns the number of checks done."""
+    rng = random.Random(seed)
+    backend = MemoryBackend()
+    # The model: waiting requests in arrival order and conversations by participant
+    waiting = []
+    participants = dict()
+    checks = 0
+    next_number = 0
+
+    for _ in range(operations):
+        choice = rng.random()
+        if choice < 0.4 or not waiting:
+            req = request(next_number)
+            req.waiting_since = int(time.time()) + next_number // 100
+            next_number += 1
+            backend.add_request(req)
+            waiting.append(req)
+        elif choice < 0.7:
+            req = rng.choice(waiting)
+            worker_id = WORKER_IDS + rng.randrange(next_number)
+            conversation = backend.claim_request(worker_id, req.user.user_id)
+            if worker_id in participants:
+                assert conversation is None, "claimed by a worker in a conversation"
+            else:
+                assert conversation.user == req.user and conversation.worker == worker_id and conversation.type == req.type
+                waiting.remove(req)
+                participants[worker_id] = participants[req.user.user_id] = conversation
+        elif choice < 0.8 and participants:
+            user_id = rng.choice(list(participants))
+            conversation = backend.remove_conversation(user_id)
+            assert conversation is participants[user_id]
+            del participants[conversation.worker.user_id], participants[conversation.user.user_id]
+        else:
+            req = rng.choice(waiting)
+            assert backend.remove_request(req.user.user_id)
+            waiting.remove(req)
+
+        user_id = PATIENT_IDS + rng.randrange(next_number)
+        expected = next((req for req in waiting if req.user.user_id == user_id), None)
+        assert backend.get_request(user_id) is expected, "request of {}".format(user_id)
+        position = None
+        if expected is not None:
+            position = [req.user.user_id for req in waiting if req.type == expected.type].index(user_id) + 1
+        assert backend.get_request_position(user_id) == position, "position of {}".format(user_id)
+        assert backend.get_conversation(user_id) is participants.get(user_id)
+        assert backend.count_requests() == len(waiting)
+        type = ConversationType(rng.randrange(2) + 1)
+        line = [req for req in waiting if req.type == type]
+        assert backend.count_requests(type) == len(line)
+        assert backend.find_requests(type, limit=3) == line[:3]
+        every_third = [req for req in line if req.user.user_id % 3 == 0]
+        assert backend.find_requests(type, lambda req: req.user.user_id % 3 == 0, 2) == every_third[:2]
+        assert backend.count_conversations() == len(participants) // 2
+        if waiting:
+            deadline = rng.choice(waiting).waiting_since
+            overdue = [req.user.user_id for req in waiting if req.waiting_since <= deadline]
+            assert sorted(req.user.user_id for req in backend.get_overdue_requests(deadline)) == sorted(overdue)
+        checks += 1
+
+    # Requests of different types waiting since the same second may come in any order
+    iterated = list(backend.iter_requests())
+    assert [req.waiting_since for req in iterated] == sorted(req.waiting_since for req in waiting)
+    assert sorted(req.user.user_id for req in iterated) == sorted(req.user.user_id for req in waiting)
+    return checks
+
+
+def run(size, operations):
+    return {
+        "memory": measure(size),
+        "checked_operations": check(operations),
+    }
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--size", type=int, default=1000000,
+                                 help="Number of entries, half of them waiting requests and half active conversations")
+    argument_parser.add_argument("--operations", type=int, default=5000, help="Random operations checked against the model")
+    args = argument_parser.parse_args()
+    params = {"size": args.size, "operations": args.operations}
+    emit("memory", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    main()
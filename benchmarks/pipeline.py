@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Drives simulated patients and workers through the real dispatcher: triage, claiming cases via deep links and chatting"""
+import time
+
+from benchmarks.fakebot import FakeBot
+from benchmarks.harness import build_dispatcher, emit, parser, percentiles
+from benchmarks.updates import UpdateFactory
+from conversations import Conversations
+
+PATIENT_IDS = 1000000
+WORKER_IDS = 9000000
+
+
+def run_phase(dispatcher, updates):
+    conversations = Conversations()
+    lookups = conversations.lookups
+    start = time.perf_counter()
+    count = 0
+    for update in updates:
+        dispatcher.process_update(update)
+        count += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "updates": count,
+        "seconds": elapsed,
+        "updates_per_second": count / elapsed if elapsed else None,
+        # Registry reads of the requests and conversations needed to handle an update
+        "lookups_per_update": (conversations.lookups - lookups) / count if count else None,
+    }
+
+
+def triage(factory, patients):
+    for patient in patients:
+        yield factory.message(patient, "/start")
+        yield factory.message(patient, "No")
+        yield factory.message(patient, "Yes")
+        yield factory.message(patient, "I have a fever of 38.5 and a dry cough since two days")
+
+
+def claim(factory, workers, patients):
+    for worker, patient in zip(workers, patients):
+        yield factory.message(worker, "/start doctor_{}".format(patient))
+
+
+def chat(factory, workers, patients, rounds):
+    for round in range(rounds):
+        for worker, patient in zip(workers, patients):
+            yield factory.message(patient, "Message {} from the patient".format(round))
+            yield factory.message(worker, "Answer {} from the doctor".format(round))
+
+
+def stop(factory, workers):
+    for worker in workers:
+        yield factory.message(worker, "/stop")
+
+
+def run(patients=2000, workers=500, rounds=10):
+    bot = FakeBot()
+    dispatcher, timings = build_dispatcher(bot)
+    factory = UpdateFactory(bot)
+
+    patient_ids = list(range(PATIENT_IDS, PATIENT_IDS + patients))
+    worker_ids = list(range(WORKER_IDS, WORKER_IDS + workers))
+
+    phases = dict()
+    total_start = time.perf_counter()
+    phases["triage"] = run_phase(dispatcher, triage(factory, patient_ids))
+    phases["claim"] = run_phase(dispatcher, claim(factory, worker_ids, patient_ids))
+    phases["chat"] = run_phase(dispatcher, chat(factory, worker_ids, patient_ids, rounds))
+    phases["stop"] = run_phase(dispatcher, stop(factory, worker_ids))
+    total = time.perf_counter() - total_start
+    updates = sum(phase["updates"] for phase in phases.values())
+
+    return {
+        "updates": updates,
+        "updates_per_second": updates / total,
+        "phases": phases,
+        "handlers": {name: percentiles(samples) for name, samples in timings.items() if samples},
+        "bot_calls": dict(bot.calls),
+    }
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--patients", type=int, default=2000)
+    argument_parser.add_argument("--workers", type=int, default=500)
+    argument_parser.add_argument("--rounds", type=int, default=10)
+    args = argument_parser.parse_args()
+    params = {"patients": args.patients, "workers": args.workers, "rounds": args.rounds}
+    emit("pipeline", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Measures how conversation lookups and relaying scale with the number of active conversations"""
+import random
+import time
+
+from backends import MemoryBackend
+from benchmarks.fakebot import FakeBot
+from benchmarks.harness import build_dispatcher, emit, parser, percentiles
+from benchmarks.updates import UpdateFactory
+from conversationrequest import ConversationType
+from conversations import Conversations
+
+PATIENT_IDS = 1000000
+WORKER_IDS = 9000000
+
+
+def populate(conversations, size):
+    conversations.use_backend(MemoryBackend())
+    for number in range(size):
+        patient_id = PATIENT_IDS + number
+        conversations.request_conversation(patient_id, "Patient", None, None, ConversationType.MEDICAL)
+        conversations.new_conversation(WORKER_IDS + number, patient_id)
+
+
+def run(sizes, samples):
+    bot = FakeBot()
+    dispatcher, timings = build_dispatcher(bot)
+    factory = UpdateFactory(bot)
+    conversations = Conversations()
+    results = dict()
+
+    for size in sizes:
+        populate(conversations, size)
+        participants = [PATIENT_IDS + number for number in range(size)] + [WORKER_IDS + number for number in range(size)]
+        chosen = [random.choice(participants) for _ in range(samples)]
+
+        lookups = []
+        for user_id in chosen:
+            start = time.perf_counter()
+            conversations.get_conversation(user_id)
+            lookups.append(time.perf_counter() - start)
+
+        updates = [factory.message(user_id, "Hello") for user_id in chosen]
+        for handler_samples in timings.values():
+            del handler_samples[:]
+        relays = []
+        for update in updates:
+            start = time.perf_counter()
+            dispatcher.process_update(update)
+            relays.append(time.perf_counter() - start)
+
+        results[str(size)] = {
+            "lookup": percentiles(lookups),
+            "relay": percentiles(relays),
+            # The router resolves the conversation and calls the relay handler of its type and kind of message
+            "handler": percentiles(timings["route_message"]),
+        }
+
+    conversations.use_backend(MemoryBackend())
+    return results
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--sizes", default="100,1000,10000,100000",
+                                 help="Comma separated numbers of active conversations")
+    argument_parser.add_argument("--samples", type=int, default=5000, help="Relayed messages per size")
+    args = argument_parser.parse_args()
+    params = {"sizes": [int(size) for size in args.sizes.split(",")], "samples": args.samples}
+    emit("registry", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Measures the end-to-end relay latency while the Bot API is slow, for different numbers of relay workers"""
+import random
+import threading
+import time
+
+from backends import MemoryBackend
+from benchmarks.fakebot import FakeBot
+from benchmarks.harness import build_dispatcher, emit, parser, percentiles
+from benchmarks.registry import PATIENT_IDS, WORKER_IDS, populate
+from benchmarks.updates import UpdateFactory
+from conversations import Conversations
+
+
+def run_once(workers, conversations, rate, duration, latency):
+    import bot as bot_module
+
+    bot = FakeBot(latency)
+    dispatcher, _ = build_dispatcher(bot)
+    factory = UpdateFactory(bot)
+    populate(Conversations(), conversations)
+
+    count = int(rate * duration)
+    senders = [random.choice((PATIENT_IDS, WORKER_IDS)) + random.randrange(conversations) for _ in range(count)]
+    updates = [factory.message(sender, "Message {}".format(number)) for number, sender in enumerate(senders)]
+    arrivals = [None] * count
+    latencies = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def on_call(method, data):
+        if method != "sendMessage":
+            return
+        number = int(data["text"].rsplit(" ", 1)[-1])
+        with lock:
+            latencies.append(time.perf_counter() - arrivals[number])
+            if len(latencies) == count:
+                done.set()
+
+    bot._request.on_call = on_call
+    executor = bot_module.relay_executor
+    executor.workers = workers
+    executor.start()
+
+    # Updates arrive at a fixed rate and are dispatched by one thread, like the Dispatcher does
+    start = time.perf_counter()
+    for number, update in enumerate(updates):
+        arrival = start + number / rate
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        arrivals[number] = arrival
+        dispatcher.process_update(update)
+    done.wait(timeout=max(60.0, count * latency))
+    elapsed = time.perf_counter() - start
+    executor.stop()
+
+    result = percentiles(latencies)
+    result["throughput"] = len(latencies) / elapsed
+    result["lost"] = count - len(latencies)
+    return result
+
+
+def run(workers, conversations, rate, duration, latency):
+    results = dict()
+    for number in workers:
+        results[str(number)] = run_once(number, conversations, rate, duration, latency)
+    Conversations().use_backend(MemoryBackend())
+    return results
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--workers", default="0,8,32", help="Comma separated numbers of relay workers to compare")
+    argument_parser.add_argument("--conversations", type=int, default=1000)
+    argument_parser.add_argument("--rate", type=float, default=200, help="Incoming messages per second")
+    argument_parser.add_argument("--duration", type=float, default=5, help="Seconds of incoming messages")
+    argument_parser.add_argument("--latency", type=float, default=0.02, help="Seconds every Bot API call takes")
+    args = argument_parser.parse_args()
+    params = {
+        "workers": [int(number) for number in args.workers.split(",")],
+        "conversations": args.conversations,
+        "rate": args.rate,
+        "duration": args.duration,
+        "latency": args.latency,
+    }
+    emit("relay", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    main()
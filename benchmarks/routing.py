@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Measures the dispatch cost of relayed messages by kind, without the cost of sending them"""
+import time
+
+from telegram import Voice, Sticker, Animation, Document
+
+from backends import MemoryBackend
+from benchmarks.fakebot import FakeBot
+from benchmarks.harness import build_dispatcher, emit, parser, percentiles
+from benchmarks.registry import PATIENT_IDS, populate
+from benchmarks.updates import UpdateFactory
+from conversations import Conversations
+
+SEND_METHODS = ["send_message", "send_photo", "send_voice", "send_animation", "send_sticker", "send_document", "send_video"]
+
+
+def kinds(factory):
+    """Returns builders of the messages to route by name, each taking the sender's user_id"""
+    return {
+        "text": lambda user_id: factory.message(user_id, "Hello"),
+        "photo": lambda user_id: factory.photo(user_id),
+        "voice": lambda user_id: factory.message(user_id, voice=Voice("voice", "voice", 3)),
+        "animation": lambda user_id: factory.message(user_id, animation=Animation("gif", "gif", 1, 1, 1),
+                                                     document=Document("gif", "gif")),
+        "sticker": lambda user_id: factory.message(user_id, sticker=Sticker("sticker", "sticker", 1, 1, False)),
+        # Users who aren't in a conversation get the "can't handle that" answer
+        "sticker_without_conversation": lambda user_id: factory.message(user_id - 1,
+                                                                        sticker=Sticker("sticker", "sticker", 1, 1, False)),
+    }
+
+
+def run(conversations, messages):
+    bot = FakeBot()
+    # Only the routing is measured, sending is the same for every routing
+    for method in SEND_METHODS:
+        setattr(bot, method, lambda *args, **kwargs: None)
+    dispatcher, _ = build_dispatcher(bot)
+    factory = UpdateFactory(bot)
+    populate(Conversations(), conversations)
+
+    results = dict()
+    for name, build in kinds(factory).items():
+        updates = [build(PATIENT_IDS + number % conversations) for number in range(messages)]
+        durations = []
+        for update in updates:
+            start = time.perf_counter()
+            dispatcher.process_update(update)
+            durations.append(time.perf_counter() - start)
+        results[name] = percentiles(durations)
+
+    Conversations().use_backend(MemoryBackend())
+    return results
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--conversations", type=int, default=1000)
+    argument_parser.add_argument("--messages", type=int, default=10000, help="Messages per kind")
+    args = argument_parser.parse_args()
+    params = {"conversations": args.conversations, "messages": args.messages}
+    emit("routing", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    main()
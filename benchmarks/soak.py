@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Sends millions of synthetic users into the triage flow and leaves them there, memory has to stay flat"""
+import gc
+import os
+import time
+
+from benchmarks.fakebot import FakeBot
+from benchmarks.harness import build_dispatcher, emit, parser, max_rss_mb
+from benchmarks.registry import PATIENT_IDS
+from benchmarks.updates import UpdateFactory
+from contextstore import iter_context_stores
+
+
+def rss_mb():
+    """Current resident memory of this process, the peak where /proc isn't available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return max_rss_mb()
+
+
+def run(users, checkpoints, max_size):
+    bot = FakeBot()
+    dispatcher, timings = build_dispatcher(bot)
+    stores = dict(iter_context_stores(dispatcher))
+    for store in stores.values():
+        store.maxsize = max_size
+    factory = UpdateFactory(bot)
+
+    samples = []
+    start = time.perf_counter()
+    step = users // checkpoints
+    for number in range(users):
+        user_id = PATIENT_IDS + number
+        # Every user starts the triage and never answers
+        dispatcher.process_update(factory.message(user_id, "/start"))
+        # Neither the factory's cache of users nor the timings are part of the bot
+        factory._users.pop(user_id, None)
+        if (number + 1) % 1000 == 0:
+            for handler_samples in timings.values():
+                del handler_samples[:]
+        if (number + 1) % step == 0:
+            gc.collect()
+            samples.append({
+                "users": number + 1,
+                "rss_mb": rss_mb(),
+                "entries": {name: len(store) for name, store in stores.items()},
+                "evicted": {name: store.evicted for name, store in stores.items()},
+            })
+
+    seconds = time.perf_counter() - start
+    # Growth between the second checkpoint, when the stores are full, and the last one
+    growth = samples[-1]["rss_mb"] - samples[min(1, len(samples) - 1)]["rss_mb"]
+    return {
+        "checkpoints": samples,
+        "rss_growth_mb": growth,
+        "users_per_second": users / seconds,
+    }
+
+
+def main():
+    argument_parser = parser(__doc__)
+    argument_parser.add_argument("--users", type=int, default=1000000, help="Number of synthetic users")
+    argument_parser.add_argument("--checkpoints", type=int, default=10, help="Number of memory samples")
+    argument_parser.add_argument("--max-size", type=int, default=10000, help="Entries kept per store")
+    args = argument_parser.parse_args()
+    params = {"users": args.users, "checkpoints": args.checkpoints, "max_size": args.max_size}
+    emit("soak", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    main()
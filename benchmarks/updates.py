@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import datetime
+import itertools
+
+from telegram import Update, Message, User, Chat, MessageEntity, PhotoSize, CallbackQuery
+
+
+class UpdateFactory(object):
+    """Builds synthetic updates as Telegram would deliver them to the bot"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._users = dict()
+
+    def user(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = User(user_id, "User{}".format(user_id), False, username="user{}".format(user_id))
+        return user
+
+    def message(self, user_id, text=None, **kwargs):
+        user = self.user(user_id)
+        entities = []
+        if text is not None and text.startswith("/"):
+            entities.append(MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text.split()[0])))
+        message = Message(next(self._message_ids), user, datetime.datetime.now(), Chat(user_id, Chat.PRIVATE),
+                          text=text, entities=entities, bot=self.bot, **kwargs)
+        return Update(next(self._update_ids), message=message)
+
+    def photo(self, user_id, media_group_id=None):
+        file_id = "photo{}".format(next(self._message_ids))
+        return self.message(user_id, photo=[PhotoSize(file_id, file_id, 1280, 720)], media_group_id=media_group_id)
+
+    def callback_query(self, user_id, data):
+        query = CallbackQuery(str(next(self._update_ids)), self.user(user_id), "benchmark", data=data, bot=self.bot)
+        return Update(next(self._update_ids), callback_query=query)
+
+    def to_json(self, update):
+        """Returns the update as a dict like in Telegram's JSON payloads"""
+        return update.to_dict()
@@ -14,247 +14,318 @@ Bot currently forwards all cases to:  https://t.me/humanbios (Bot has to be a me
 """
 
 import logging
+import math
 import os
-from enum import IntEnum
+import time
+from queue import Queue
 from functools import wraps
 
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, ParseMode
+from telegram import ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, ParseMode
 from telegram import Update
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler, CallbackQueryHandler, CallbackContext as Context
-from telegram.utils import helpers
-
-import filters
+from telegram.constants import MAX_MESSAGE_LENGTH
+from telegram.ext import Updater, Dispatcher, JobQueue, CommandHandler, MessageHandler, Filters, ConversationHandler, CallbackQueryHandler, TypeHandler, CallbackContext as Context
+from telegram.ext import DispatcherHandlerStop
+
+from admission import Admission
+from albumcollector import AlbumCollector, send_media
+from assignments import Assignments
+from backends import MemoryBackend, SQLiteBackend
+from botidentity import BotIdentity
 from config import settings
+from contextstore import ExpiringDict, bound_conversations, iter_context_stores
 from conversationrequest import ConversationType
 from conversations import Conversations
-from demo import demo_conv_handler
+from escalations import Escalations
+from flow import load_flows
+from idlereaper import IdleReaper
+from journal import Journal
+from journalpersistence import JournalPersistence
+from logpipeline import setup_logging
+from messagerouter import MessageRouter, MessageKind
+from metrics import Metrics, MetricsServer, InstrumentedRequest, instrument_handlers
+from queueboard import QueueBoard
+from relayexecutor import RelayExecutor
+from reports import ReportStore, BlockedUserHandler
+from sendqueue import SendQueue, QueuedBot
+from resolvedconversation import resolve_conversation
+from throttle import SenderThrottle, ThrottledUpdateHandler, update_kind, MESSAGE, COMMAND, CALLBACK
+from updatequeue import WebhookUpdateQueue
 
 conversations = Conversations()
+bot_identity = BotIdentity()
+relay_executor = RelayExecutor(settings.RELAY_WORKERS)
+albums = AlbumCollector(relay_executor, delay=settings.ALBUM_COLLECT_DELAY)
+send_queue = SendQueue(workers=settings.SEND_QUEUE_WORKERS,
+                       global_rate=settings.SEND_GLOBAL_RATE,
+                       private_rate=settings.SEND_PRIVATE_RATE,
+                       private_burst=settings.SEND_PRIVATE_BURST,
+                       group_rate=settings.SEND_GROUP_RATE,
+                       group_burst=settings.SEND_GROUP_BURST)
+
+
+def oldest_request_wait():
+    req = conversations.get_oldest_request()
+    return 0 if req is None else time.time() - req.waiting_since
+
+
+# Served in the Prometheus text format on METRICS_PORT
+metrics = Metrics()
+handler_latency = metrics.histogram("bot_handler_duration_seconds", "Duration of handler callbacks", ["handler"])
+api_latency = metrics.histogram("bot_api_request_duration_seconds", "Duration of Bot API calls", ["method"])
+flood_errors = metrics.counter("bot_api_flood_errors_total", "Bot API calls rejected with 429 Too Many Requests", ["method"])
+updates_received = metrics.counter("bot_updates_total", "Updates received by the dispatcher")
+metrics.callback_counter("bot_registry_lookups_total", "Lookups of a user's request or conversation",
+                         func=lambda: conversations.lookups)
+metrics.gauge("bot_waiting_requests", "Users waiting for a conversation", func=conversations.count_waiting_requests)
+metrics.gauge("bot_oldest_request_wait_seconds", "Seconds the longest waiting user has been waiting", func=oldest_request_wait)
+metrics.gauge("bot_arrival_rate", "Requests per second, exponentially weighted", func=conversations.admission.arrival_rate)
+metrics.gauge("bot_service_rate", "Requests served per second, exponentially weighted", func=conversations.admission.service_rate)
+metrics.gauge("bot_expected_wait_seconds", "Wait a new user can expect, 0 while unknown", func=lambda: conversations.admit()[1] or 0)
+conversations_expired = metrics.counter("bot_conversations_expired_total", "Conversations ended after being idle")
+admissions = metrics.counter("bot_admissions_total", "Admission decisions for new users", ["decision"])
+user_reports = metrics.counter("bot_reports_total", "Reports of users by workers")
+blocked_updates = metrics.counter("bot_blocked_updates_total", "Updates of blocked users which have been dropped")
+metrics.gauge("bot_active_conversations", "Active conversations", func=conversations.count_active_conversations)
+metrics.gauge("bot_relay_pending", "Messages waiting for a relay worker", func=relay_executor.pending)
+metrics.gauge("bot_send_queue_depth", "Outbound calls waiting in the send queue", func=lambda: send_queue.depth)
+metrics.callback_counter("bot_send_queue_sent_total", "Outbound calls sent by the send queue", func=lambda: send_queue.sent)
+metrics.callback_counter("bot_send_queue_failures_total", "Outbound calls which failed", func=lambda: send_queue.failed)
+metrics.callback_counter("bot_send_queue_retries_total", "Outbound calls retried after a flood limit error",
+                         func=lambda: send_queue.retries)
+send_queue.observe_delay = metrics.histogram("bot_send_queue_delay_seconds",
+                                             "Seconds outbound calls waited in the send queue before being sent").observe
 
-# enable logging
-project_path = os.path.dirname(os.path.abspath(__file__))
-logdir_path = os.path.join(project_path, "logs")
-logfile_path = os.path.join(logdir_path, "bot.log")
-
-if not os.path.exists(logdir_path):
-    os.makedirs(logdir_path)
-
-logfile_handler = logging.handlers.WatchedFileHandler(logfile_path, 'a', 'utf-8')
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    level=logging.INFO, handlers=[logfile_handler])
-logging.getLogger("telegram").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
+# Sampled per-message records, see config/logger.yaml
+relay_logger = logging.getLogger("bot.relay")
 
 
 def chat_conversation(func):
-    """Decorator that performs checks and prepares data for the called function"""
+    """Decorator that performs checks and prepares data for the called function.
+
+    The decorated function is executed by the relay executor, sharded by conversation to keep the messages in order."""
 
     @wraps(func)
     def wrapper(update: Update, context: Context):
-        sender = int(update.effective_user.id)
-        conversation = conversations.get_conversation(sender)
+        resolved = resolve_conversation(update.effective_message)
 
-        if conversation is None:
+        if resolved is None:
             return
 
-        if conversation.type == ConversationType.MEDICAL:
-            prefix = "👩🏻‍⚕️: "
-        elif conversation.type == ConversationType.SOCIAL:
-            prefix = "🧔🏻: "
-        else:
+        if resolved.prefix is None:
             logger.error("Conversation is neither social or medical!")
             return
 
-        if sender == conversation.worker:
-            recipient = conversation.user
-        elif sender == conversation.user:
-            recipient = conversation.worker
-        else:
-            logger.error("Sender is neither worker, nor user!")
-            return
-
-        func(update, context, sender, recipient, prefix, conversation)
+        relay_executor.submit(resolved.conversation.user.user_id, relay, func, update, context, resolved)
 
     return wrapper
 
 
-# definitions
-class Decisions(IntEnum):
-    AGE = 1
-    FEEL_OK = 2
-    COUGH_FEVER = 3
-    STRESSED_ANXIOUS = 4
-    WANNA_HELP = 5
-    TELL_FRIENDS = 6
-    CASE_DESC = 7
+def relay(func, update, context, resolved):
+    """Runs a relay handler on the conversation's relay worker, after sending a pending album the message isn't part of.
 
+    Errors are passed to the dispatcher's error handlers, as if the handler had run on the dispatcher"""
+    idle_reaper.touch(resolved.conversation.user.user_id)
+    try:
+        albums.flush(resolved.conversation.user.user_id, update.effective_message.media_group_id)
+        func(update, context, resolved.sender, resolved.recipient, resolved.prefix, resolved.conversation)
+    except Exception as e:
+        context.dispatcher.dispatch_error(update, e)
+        return
+    # Arguments instead of format(), so that nothing is formatted while the record is disabled or sampled out
+    relay_logger.debug("Relayed message %s from %s to %s", update.effective_message.message_id, resolved.sender,
+                       resolved.recipient.user_id)
 
-yes_no_keyboard = ReplyKeyboardMarkup([["Yes", "No"]])
 
 REPEAT_INTERVAL = 10
 
 
-# methods & commands
-def cancel(update, context):
-    text_cancel = "Bye! I hope we can talk again some day."
-    update.message.reply_text(text=text_cancel, reply_markup=ReplyKeyboardRemove())
-    return ConversationHandler.END
+def cases_handled(context, worker_id):
+    """Returns the number of cases a worker took. The counts are kept in bot_data, which unlike user_data is never evicted"""
+    return context.bot_data.get(worker_id, 0)
 
 
-def welcome(update, context):
+def count_case(context, worker_id):
+    context.bot_data[worker_id] = cases_handled(context, worker_id) + 1
 
-    """Greets users, which use the /start command"""
-    if conversations.limit_reached():
-        update.message.reply_text("Hello there. Sorry but the queue of waiting users is currently just too long. In order to prevent users from becoming "
-                                  "frustrated, because of long waiting times, we decided to not accept new users for now. Please try again soon. Bye.")
-        return ConversationHandler.END
 
+def format_wait(seconds):
+    return "about {} minutes".format(max(1, int(math.ceil(seconds / 60))))
+
+
+def admit_user(update, context):
+    """Starts the triage flow unless the user is already waiting or in a conversation or the expected wait is too long"""
     if conversations.has_active_conversation(update.effective_user.id):
         update.message.reply_text("You are already having a conversation. You can end it with /stop.")
-        return ConversationHandler.END
+        return False
     elif conversations.is_user_waiting(update.effective_user.id):
-        update.message.reply_text("You are already waiting for an answer. Please be patient. We'll handle you request soon.")
-        return ConversationHandler.END
-
-    text_greeting = "Hello there. Thank you for contacting HumanbiOS."
-    context.user_data["decision"] = None
-    update.message.reply_text(text=text_greeting)
-
-    text_are_you_okay = "Are you feeling Ok?"
-    update.message.reply_text(text=text_are_you_okay, reply_markup=yes_no_keyboard)
-    return Decisions.FEEL_OK
+        # The case may be claimed in between, then it has left the line already
+        position = conversations.get_queue_position(update.effective_user.id)
+        text = "You are already waiting for an answer. Please be patient. We'll handle you request soon. "
+        if position is None:
+            text += "A helper is picking up your request right now."
+        else:
+            text += "You are number {} in line.".format(position)
+        update.message.reply_text(text)
+        return False
+
+    admission, wait = conversations.admit()
+    admissions.inc(labels=(admission.value,))
+    if admission is Admission.DEFER:
+        retry_after = conversations.admission.retry_after(wait)
+        update.message.reply_text("Hello there. Sorry but the queue of waiting users is currently just too long. In order to prevent users from becoming "
+                                  "frustrated, because of long waiting times, we decided to not accept new users for now. "
+                                  "Please try again in {}. Bye.".format(format_wait(retry_after)))
+        return False
+    if admission is Admission.WARN:
+        update.message.reply_text("Please note that our helpers are very busy right now. If you need help, you can expect to wait {}."
+                                  .format(format_wait(wait)))
+    return True
 
 
-def cough(update, context):
+# Room names used in the deep links and by /available
+ROOM_TYPES = {"doctor": ConversationType.MEDICAL, "psychologist": ConversationType.SOCIAL}
+ROOM_NAMES = {type: name for name, type in ROOM_TYPES.items()}
 
-    text_cough = "Oh no, I'm sorry about that! Are you having cough or fever?"
-    context.user_data["decision"] = Decisions.COUGH_FEVER
-    update.message.reply_text(text=text_cough, reply_markup=yes_no_keyboard)
-    return Decisions.COUGH_FEVER
 
+def request_room(update, context, type, room_name):
+    user = update.effective_user
+    req = conversations.request_conversation(user_id=user.id,
+                                             first_name=user.first_name,
+                                             last_name=user.last_name,
+                                             username=user.username,
+                                             type=type)
+    if req is None:
+        # The same user's /start in another update, e.g. handled by another dispatcher thread, got there first
+        update.message.reply_text("You are already waiting for an answer or having a conversation.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+    escalations.arm(context.job_queue, req)
+    # Offered to an available worker first, broadcast to the room if nobody takes it
+    assignments.offer(context, req, update.message.text)
+    # An available worker, another dispatcher thread or another process may have claimed the case already
+    position = conversations.get_queue_position(user.id)
+    if position is None:
+        text = "Forwarded your request to the {}! A helper is picking it up right now.".format(room_name)
+    else:
+        text = "Forwarded your request to the {}! You are number {} in line.".format(room_name, position)
+        wait = conversations.admission.expected_wait(position - 1)
+        if wait:
+            text += " The expected waiting time is {}.".format(format_wait(wait))
+    update.message.reply_text(text, reply_markup=ReplyKeyboardRemove())
+    return ConversationHandler.END
 
-def stressed(update, context):
-    text_stressed = "Good! Are you feeling stressed or anxious?"
-    context.user_data["decision"] = Decisions.STRESSED_ANXIOUS
-    update.message.reply_text(text=text_stressed, reply_markup=yes_no_keyboard)
-    return Decisions.STRESSED_ANXIOUS
 
+def doctors_room(update, context):
+    return request_room(update, context, ConversationType.MEDICAL, "doctor's room")
 
-def wanna_help(update, context):
-    # TODO we need some way to invite new members to the group chat
-    text_wanna_help = "That's great! Do you wanna help?"
-    context.user_data["decision"] = Decisions.WANNA_HELP
-    update.message.reply_text(text=text_wanna_help, reply_markup=yes_no_keyboard)
-    return Decisions.WANNA_HELP
 
+def psychologists_room(update, context):
+    return request_room(update, context, ConversationType.SOCIAL, "psychologists' room")
 
-def desc(update, context):
 
-    decision = context.user_data.get("decision", None)
+def broadcast_request(context, req, description):
+    """Puts a case on the queue board of its room, where every worker can claim it with the deep link"""
+    case_boards[req.type].update(context.job_queue)
 
-    if decision is None:
-        logger.error("Decision is None")
-        return ConversationHandler.END
-    elif decision == Decisions.STRESSED_ANXIOUS:
-        text = "Please tell us a little about your current situation. How are you feeling? Are you afraid? Take a minute to relax and breath. " \
-               "Tell us also about your friends and family"
-    elif decision == Decisions.COUGH_FEVER:
-        text = "Dear patient, we will try to help you as much as we can. Please tell us about your symptoms. Also what is your current body temperature?"
-    elif decision == Decisions.WANNA_HELP:
-        text = "Welcome new member. We are so glad you’re here! Please provide a short description of what you would like to help with and what you can do. " \
-               "Keep it brief and professional"
-    else:
-        logger.error("Unknown decision {}".format(decision))
-        return ConversationHandler.END
-    update.message.reply_text(text=text, reply_markup=ReplyKeyboardRemove())
-    return Decisions.CASE_DESC
 
+def update_boards(context):
+    """Refreshes the wait times on the queue boards, boards whose text didn't change aren't edited"""
+    for board in (*case_boards.values(), new_members_board):
+        board.update(context.job_queue)
 
-def bye(update, context):
 
-    text_bye = "Okay, please tell your friends about humanbios!"
-    update.message.reply_text(text=text_bye, reply_markup=ReplyKeyboardRemove())
-    return ConversationHandler.END
+def short_description(description, length=100):
+    description = " ".join((description or "").split())
+    return description if len(description) <= length else description[:length - 1] + "…"
 
 
-def forward(update, context):
+def render_case_board(type):
+    """Returns the text and buttons of the queue board of the room of type, listing the oldest waiting cases"""
+    room_type = ROOM_NAMES[type]
+    now = time.time()
+    # Cases offered to an available worker are shown once the worker declined them or the offer expired. Only the line
+    # of type is read, up to the cases shown on the board
+    cases = conversations.find_waiting_requests(type, lambda req: assignments.is_broadcast(req.user.user_id),
+                                                settings.QUEUE_BOARD_MAX_CASES)
+    if not cases:
+        return "Nobody is waiting for a {} right now.".format(room_type), None
 
-    """Forwards a user's data based on their previous decisions to a certain group"""
-    decision = context.user_data.get("decision", None)
+    # The count includes the cases currently offered to a worker
+    waiting = conversations.count_waiting_requests(type)
+    lines = ["Users waiting for a {}: {}".format(room_type, waiting)]
+    length = len(lines[0])
+    buttons = []
+    for number, req in enumerate(cases, 1):
+        user = req.user
+        minutes = int(now - req.waiting_since) // 60
+        line = f"\n{number}. {user.first_name} (@{user.username}) - waiting for {minutes} min"
+        overdue = [tier for tier in settings.ESCALATION_TIERS if tier <= minutes]
+        if overdue:
+            line += f" - more than {max(overdue)} minutes!"
+        description = short_description(assignments.get_description(user.user_id))
+        if description:
+            line += f"\n{description}"
+        # Leaves room for the last line within Telegram's limit of 4096 characters
+        length += len(line) + 1
+        if length > MAX_MESSAGE_LENGTH - 100:
+            break
+        lines.append(line)
+        buttons.append([InlineKeyboardButton(f"Assign {number}. {user.first_name} to me", url=bot_identity.assign_url(room_type, user.user_id)),
+                        InlineKeyboardButton(callback_data=bot_identity.report_callback_data(user.user_id), text=f"Report {number}.")])
+    if waiting > len(buttons):
+        lines.append("\n... and {} more".format(waiting - len(buttons)))
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
+
+
+def offer_case(context, worker_id, req, description):
+    """Offers a case to a single available worker"""
+    user = req.user
+    text = f"You have been picked for a case! Please accept it within {assignments.timeout} seconds.\n\n" \
+           f"Name: {user.first_name}\n" \
+           f"Username: @{user.username}"
+    if description is not None:
+        text += f"\nCase description: {description}"
+    context.bot.send_message(
+        chat_id=worker_id, text=text,
+        disable_web_page_preview=True,
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(callback_data=bot_identity.accept_callback_data(user.user_id), text="Accept"),
+                                            InlineKeyboardButton(callback_data=bot_identity.decline_callback_data(user.user_id), text="Decline")]])
+    )
 
-    if decision is None:
-        logger.error("Decision is None")
-        return ConversationHandler.END
-    elif decision == Decisions.STRESSED_ANXIOUS:
-        psychologists_room(update, context)
-    elif decision == Decisions.COUGH_FEVER:
-        doctors_room(update, context)
-    elif decision == Decisions.WANNA_HELP:
-        new_members_room(update, context)
 
-    return ConversationHandler.END
+def offer_expired(context, worker_id, req):
+    context.bot.send_message(chat_id=worker_id, text="You didn't accept the case in time, so it has been passed on to the room. "
+                                                     "We won't offer you any further cases until you send /available again.")
 
 
-def doctors_room(update, context):
+# user_id -> (user, description, time.time()) of the latest users who want to help, oldest first
+new_members = dict()
 
-    user = update.effective_user
-    assign_url = helpers.create_deep_linked_url(context.bot.get_me().username, "doctor_" + str(user.id))
-    conversations.request_conversation(user_id=user.id,
-                                       first_name=user.first_name,
-                                       last_name=user.last_name,
-                                       username=user.username,
-                                       type=ConversationType.MEDICAL)
-    context.bot.send_message(
-        chat_id=settings.TELEGRAM_DOCTOR_ROOM, text=f"A user requested medical help!\n\n"
-                                                    f"Name: {user.first_name}\n"
-                                                    f"Username: @{user.username}\n"
-                                                    f"Case description: {update.message.text}",
-        disable_web_page_preview=True,
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Assign Case to me", url=assign_url),
-                                            InlineKeyboardButton(callback_data="report_" + str(user.id), text="Report User")]])
-    )
-    update.message.reply_text(
-        "Forwarded your request to the doctor's room!",
-        reply_markup=ReplyKeyboardRemove(),
-    )
-    return ConversationHandler.END
 
+def render_new_members_board():
+    """Returns the text and buttons of the board of the new members' room, listing the latest users who want to help"""
+    members = list(new_members.values())
+    if not members:
+        return "Nobody asked to help recently.", None
 
-def psychologists_room(update, context):
-    user = update.effective_user
-    assign_url = helpers.create_deep_linked_url(context.bot.get_me().username, "psychologist_" + str(user.id))
-    conversations.request_conversation(user_id=user.id,
-                                       first_name=user.first_name,
-                                       last_name=user.last_name,
-                                       username=user.username,
-                                       type=ConversationType.SOCIAL)
-    context.bot.send_message(
-        chat_id=settings.TELEGRAM_PSYCHOLOGIST_ROOM, text=f"A user wants to talk!\n\n"
-                                                          f"Name: {user.first_name}\n"
-                                                          f"Username: @{user.username}\n"
-                                                          f"Case description: {update.message.text}",
-        disable_web_page_preview=True,
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Assign Case to me", url=assign_url),
-                                            InlineKeyboardButton(callback_data="report_" + str(user.id), text="Report User")]])
-    )
-    update.message.reply_text(
-        "Forwarded your request to the psychologists' room!",
-        reply_markup=ReplyKeyboardRemove(),
-    )
-    return ConversationHandler.END
+    now = time.time()
+    lines = ["Users who want to help:"]
+    buttons = []
+    for number, (user, description, since) in enumerate(reversed(members), 1):
+        minutes = int(now - since) // 60
+        lines.append(f"\n{number}. {user.first_name} (@{user.username}) - {minutes} min ago\n{short_description(description)}")
+        buttons.append([InlineKeyboardButton(callback_data=bot_identity.report_callback_data(user.id), text=f"Report {number}. {user.first_name}")])
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
 
 
 def new_members_room(update, context):
     # TODO We need something similar to the "assign case to me" button for this case
     user = update.effective_user
-    context.bot.send_message(
-        chat_id=settings.TELEGRAM_NEW_MEMBERS_ROOM, text=f"A user wants to help:\n\n"
-                                                         f"Name: {user.first_name}\n"
-                                                         f"Username: @{user.username}\n"
-                                                         f"Case description: {update.message.text}",
-        disable_web_page_preview=True,
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(callback_data="report_" + str(user.id), text="Report User")]])
-    )
+    new_members.pop(user.id, None)
+    new_members[user.id] = (user, update.message.text, time.time())
+    if len(new_members) > settings.QUEUE_BOARD_MAX_CASES:
+        del new_members[next(iter(new_members))]
+    new_members_board.update(context.job_queue)
     update.message.reply_text(
         "Forwarded your request to the new members' room!",
         reply_markup=ReplyKeyboardRemove(),
@@ -262,105 +333,192 @@ def new_members_room(update, context):
     return ConversationHandler.END
 
 
-def invalid_answer(update: Update, context: Context):
-    text = "Sorry, but that's not any of the expected answers."
-    update.message.reply_text(text=text)
+def is_room(chat_id):
+    """Returns True if chat_id is one of the rooms, whose members are the workers"""
+    return str(chat_id) in (settings.TELEGRAM_DOCTOR_ROOM, settings.TELEGRAM_PSYCHOLOGIST_ROOM, settings.TELEGRAM_NEW_MEMBERS_ROOM)
 
 
-yesfilter = Filters.regex('^Yes$')
-nofilter = Filters.regex('^No$')
+def report_handler(update, context):
+    """Handles the reports of workers, users reported by REPORT_BLOCK_THRESHOLD workers are blocked"""
+    query = update.callback_query
+    user_id = int(query.data.split("_")[-1])
+    reporter_id = query.from_user.id
+    # The report buttons are only posted in the rooms
+    if query.message is None or not is_room(query.message.chat_id):
+        query.answer(text="Only workers can report users.")
+        return
+    if reporter_id == user_id:
+        query.answer(text="You can't report yourself.")
+        return
 
-conv_handler = ConversationHandler(
-    entry_points=[CommandHandler("start", welcome)],
-    states={
-        Decisions.FEEL_OK: [
-            MessageHandler(yesfilter, wanna_help),
-            MessageHandler(nofilter, cough)
-        ],
+    user_reports.inc()
+    if reports.report(reporter_id, user_id):
+        logger.info("Blocked user {} after {} reports".format(user_id, reports.count_reports(user_id)))
+        block_user(context, user_id)
+    query.answer(text="Thank you for your report!")
 
-        Decisions.WANNA_HELP: [
-            MessageHandler(yesfilter, desc),
-            MessageHandler(nofilter, bye)
-        ],
 
-        Decisions.COUGH_FEVER: [
-            MessageHandler(yesfilter, desc),
-            MessageHandler(nofilter, stressed)
-        ],
+def block_user(context, user_id):
+    """Removes a blocked user from the queue, ends its conversation and takes it off the new members' board"""
+    req = conversations.get_request(user_id)
+    if req is not None and conversations.cancel_request(user_id):
+        escalations.cancel(user_id)
+        offered_to = assignments.claimed(user_id)
+        if offered_to is not None:
+            assignments.worker_idle(context, offered_to, cases_handled(context, offered_to))
+        case_boards[req.type].update(context.job_queue)
+
+    conversation = conversations.stop_conversation(user_id)
+    if conversation is not None:
+        key = conversation.user.user_id
+        idle_reaper.forget(key)
+        other = conversation.worker if conversation.user.user_id == user_id else conversation.user
+        relay_executor.submit(key, context.bot.send_message, chat_id=other.user_id,
+                              text="The conversation has been ended, because the other side has been reported.")
+        assignments.worker_idle(context, other.user_id, cases_handled(context, other.user_id))
+
+    if new_members.pop(user_id, None) is not None:
+        new_members_board.update(context.job_queue)
+
+
+def unblock_handler(update, context):
+    """Lifts the block of a user, e.g. /unblock 12345 in one of the rooms"""
+    if not is_room(update.effective_chat.id):
+        return
+    try:
+        user_id = int(context.args[0])
+    except (IndexError, ValueError):
+        update.message.reply_text("Please tell me whom to unblock: /unblock <user id>")
+        return
+    if reports.unblock(user_id):
+        update.message.reply_text("User {} has been unblocked.".format(user_id))
+    else:
+        update.message.reply_text("User {} isn't blocked.".format(user_id))
 
-        Decisions.STRESSED_ANXIOUS: [
-            MessageHandler(yesfilter, desc),
-            MessageHandler(nofilter, bye)
-        ],
 
-        Decisions.CASE_DESC: [
-            MessageHandler(Filters.text, forward)
-        ],
-    },
-    fallbacks=[CommandHandler("cancel", cancel), MessageHandler(Filters.all, invalid_answer)],
-)
+def drop_blocked_update(update, context):
+    blocked_updates.inc()
+    raise DispatcherHandlerStop()
 
 
-def report_handler(update, context):
+def drop_throttled_update(update, context):
+    """Drops an update exceeding the limits of its sender, who is told about it once"""
+    if throttle.take_notice(update_kind(update), update.effective_user.id):
+        text = "You are sending messages too fast. Please slow down, I'm ignoring your messages for a moment."
+        if update.callback_query is not None:
+            update.callback_query.answer(text=text)
+        else:
+            context.bot.send_message(chat_id=update.effective_user.id, text=text)
+    raise DispatcherHandlerStop()
 
-    """Handles the reports of workers"""
-    query = update.callback_query
-    data = update.callback_query.data
-    orig_user_id = update.callback_query.from_user.id
-    # TODO check if user is doctor or admin
-    # TODO logic for reporting users
 
-    query.answer(text="Thank you for your report!")
+def assign_case(context, worker_id, user_id, room_type):
+    """Connects a worker with the waiting user user_id. Returns whether the case has been assigned to the worker"""
+
+    def reply(text, **kwargs):
+        context.bot.send_message(chat_id=worker_id, text=text, **kwargs)
+
+    if conversations.has_active_conversation(worker_id):
+        reply("Sorry, you are already in a conversation. Please use /stop to end it, before starting a new one.")
+        return False
+
+    if not conversations.is_user_waiting(user_id):
+        if not conversations.has_active_conversation(user_id):
+            reply("Sorry, but this case is already closed!")
+            return False
+        reply("Sorry, but this case is assigned to someone else!")
+        return False
+
+    context.user_data["case"] = user_id
+    try:
+        conversation = conversations.new_conversation(worker_id, user_id)
+        if conversation is None:
+            # Another worker, possibly served by another bot process, claimed the case in the meantime
+            reply("Sorry, but this case is assigned to someone else!")
+            return False
+        escalations.cancel(user_id)
+        case_boards[conversation.type].update(context.job_queue)
+        idle_reaper.watch(context.job_queue, conversation)
+        offered_to = assignments.claimed(user_id, worker_id)
+        if offered_to is not None:
+            assignments.worker_idle(context, offered_to, cases_handled(context, offered_to))
+
+        count_case(context, worker_id)
+    except ValueError:
+        reply("You can't talk to yourself! Please wait for someone else to take over your case.")
+        return False
+    reply("Case assigned to you! You are now connected to the patient!")
+
+    if room_type == "psychologist":
+        reply("[How do you calm someone down?](https://medium.com/@humanbios/how-do-you-calm-someone-down-b178c5a2a3c8)", parse_mode=ParseMode.MARKDOWN)
+    if room_type == "doctor" and cases_handled(context, worker_id) % REPEAT_INTERVAL == 1:
+        reply("[Emergency Heuristics](https://medium.com/@humanbios/emergency-heuristics-2f62e58aa567)", parse_mode=ParseMode.MARKDOWN)
+        reply("[WHO treatment recommendations](https://apps.who.int/iris/rest/bitstreams/1272288/retrieve)", parse_mode=ParseMode.MARKDOWN)
+
+    context.bot.send_message(chat_id=user_id, text="Hey, we found a doctor who can help you. You are now connected to them - simply send your messages in "
+                                                   "here.")
+    return True
 
 
 def deeplink(update, context):
 
     # TODO check if the user requesting to take over is a registered doctor/psychologist
     # TODO check if the passed user_id is legit
-    # TODO check if the case is already assigned
     user_id = int(update.message.text.split("_")[-1])
 
     room_type = context.args[0].split("_")[0]
-    logger.setLevel(logging.DEBUG)
     logger.debug("Room type: {}".format(room_type))
 
-    worker_id = update.effective_user.id
+    assign_case(context, update.effective_user.id, user_id, room_type)
 
-    if conversations.has_active_conversation(worker_id):
-        update.message.reply_text("Sorry, you are already in a conversation. Please use /stop to end it, before starting a new one.")
-        return
 
-    if not conversations.conversation_requests.has_user_request(user_id):
-        if not conversations.has_active_conversation(user_id):
-            update.message.reply_text("Sorry, but this case is already closed!")
-            return
-        update.message.reply_text("Sorry, but this case is assigned to someone else!")
+def offer_handler(update, context):
+    """Handles the Accept and Decline buttons of the offers sent by the assignments"""
+    query = update.callback_query
+    action, user_id = query.data.split("_")
+    user_id = int(user_id)
+    worker_id = query.from_user.id
+
+    if not assignments.is_offered(worker_id, user_id):
+        query.answer(text="This offer isn't valid anymore.")
+        query.edit_message_reply_markup(reply_markup=None)
         return
+    query.edit_message_reply_markup(reply_markup=None)
 
-    context.user_data["case"] = user_id
-    try:
-        conversations.new_conversation(worker_id, user_id)
+    if action == "decline":
+        query.answer(text="Case declined.")
+        assignments.decline(context, worker_id, user_id)
+        assignments.worker_idle(context, worker_id, cases_handled(context, worker_id))
+        return
 
-        if context.bot_data.get(worker_id):
-            context.bot_data[worker_id] += 1
-        else:
-            context.bot_data[worker_id] = 1
-    except ValueError:
-        update.message.reply_text("You can't talk to yourself! Please wait for someone else to take over your case.")
+    query.answer()
+    req = conversations.get_request(user_id)
+    if req is None:
+        assign_case(context, worker_id, user_id, None)
+        assignments.claimed(user_id)
+        assignments.worker_idle(context, worker_id, cases_handled(context, worker_id))
+    elif not assign_case(context, worker_id, user_id, ROOM_NAMES[req.type]):
+        assignments.decline(context, worker_id, user_id)
+
+
+def available_handler(update, context):
+    """Makes a worker available for automatically assigned cases of a room, e.g. /available doctor"""
+    room_type = context.args[0].lower() if context.args else None
+    if room_type not in ROOM_TYPES:
+        update.message.reply_text("Please tell me which cases you can take: /available {}".format(" or /available ".join(ROOM_TYPES)))
         return
-    update.message.reply_text("Case assigned to you! You are now connected to the patient!")
 
-    if room_type == "psychologist":
-        update.message.reply_text(
-            "[How do you calm someone down?](https://medium.com/@humanbios/how-do-you-calm-someone-down-b178c5a2a3c8)", parse_mode=ParseMode.MARKDOWN)
-    if room_type == "doctor" and context.bot_data[worker_id] % REPEAT_INTERVAL == 1:
-        update.message.reply_text(
-            "[Emergency Heuristics](https://medium.com/@humanbios/emergency-heuristics-2f62e58aa567)", parse_mode=ParseMode.MARKDOWN)
-        update.message.reply_text(
-            "[WHO treatment recommendations](https://apps.who.int/iris/rest/bitstreams/1272288/retrieve)", parse_mode=ParseMode.MARKDOWN)
+    worker_id = update.effective_user.id
+    assignments.set_available(worker_id, ROOM_TYPES[room_type])
+    update.message.reply_text("You are now available for {} cases. I'll send you the next case, please accept it within {} seconds. "
+                              "Use /away to stop receiving cases.".format(room_type, assignments.timeout))
+    if not conversations.has_active_conversation(worker_id):
+        assignments.worker_idle(context, worker_id, cases_handled(context, worker_id))
 
-    context.bot.send_message(chat_id=user_id, text="Hey, we found a doctor who can help you. You are now connected to them - simply send your messages in "
-                                                   "here.")
+
+def away_handler(update, context):
+    assignments.set_away(context, update.effective_user.id)
+    update.message.reply_text("You won't receive any further cases. Use /available to receive cases again.")
 
 
 @chat_conversation
@@ -371,7 +529,12 @@ def chat_text_handler(update, context, sender, recipient, prefix, conversation):
 
 @chat_conversation
 def chat_media_handler(update, context, sender, recipient, prefix, conversation):
-    logger.info(update.message)
+    """Relays photos, videos and documents. The items of an album are collected and sent as one album"""
+    message = update.message
+    if message.media_group_id is not None:
+        albums.add(conversation.user.user_id, message, context.bot, recipient.user_id, prefix, context.job_queue)
+        return
+    send_media(context.bot, recipient.user_id, message, caption=prefix + (message.caption or ""))
 
 
 @chat_conversation
@@ -392,6 +555,9 @@ def chat_sticker_handler(update, context, sender, recipient, prefix, conversatio
 
 @chat_conversation
 def chat_photo_handler(update, context, sender, recipient, prefix, conversation):
+    if update.message.media_group_id is not None:
+        albums.add(conversation.user.user_id, update.message, context.bot, recipient.user_id, prefix, context.job_queue)
+        return
     photo = update.message.photo[-1]
     context.bot.send_photo(chat_id=recipient.user_id, photo=photo.file_id)
 
@@ -403,75 +569,265 @@ def chat_gif_handler(update, context, sender, recipient, prefix, conversation):
 
 
 def stop_conversation(update: Update, context: Context):
-    sender = int(update.effective_user.id)
-    conv = conversations.get_conversation(sender)
-    if conv is not None:
-        update.message.reply_text("I ended the conversation!")
-        if conv.worker == sender:
-            recipient = conv.user
-        else:
-            recipient = conv.worker
-        context.bot.send_message(chat_id=recipient.user_id, text="Your opponent ended the conversation!")
-    conversations.stop_conversation(sender)
-
-
-def forbidden_handler(update: Update, context: Context):
-    update.message.reply_text("Sorry, I can't handle that type of messages!")
-
+    resolved = resolve_conversation(update.effective_message)
+    if resolved is None:
+        return
+    # Both sides might /stop at the same time, only the one which ended the conversation tells the other
+    if conversations.stop_conversation(resolved.sender) is None:
+        return
 
-def check_waiting_conversations(context):
-    """Check for all users waiting for >15 minutes to notify workers about waiting cases"""
-    long_waiting_reqs = conversations.get_waiting_requests()
+    update.message.reply_text("I ended the conversation!")
+    # Queued behind the messages of this conversation which are still being relayed
+    key = resolved.conversation.user.user_id
+    relay_executor.submit(key, albums.flush, key)
+    relay_executor.submit(key, context.bot.send_message, chat_id=resolved.recipient.user_id, text="Your opponent ended the conversation!")
+    idle_reaper.forget(key)
+    # The worker gets the next case if it's available
+    worker_id = resolved.conversation.worker.user_id
+    assignments.worker_idle(context, worker_id, cases_handled(context, worker_id))
+
+
+def expire_conversation(context, user_id):
+    """Ends a conversation in which nobody wrote anything for CONVERSATION_IDLE_TIMEOUT seconds"""
+    conversation = conversations.stop_conversation(user_id)
+    if conversation is None:
+        return
+    conversations_expired.inc()
 
-    for req in long_waiting_reqs:
-        user = req.user
-        text = "User {} (@{}) is waiting for > 15 minutes!".format(user.first_name, user.username)
-        if req.type == ConversationType.MEDICAL:
-            context.bot.send_message(settings.TELEGRAM_DOCTOR_ROOM, text=text)
-        elif req.type == ConversationType.SOCIAL:
-            context.bot.send_message(settings.TELEGRAM_PSYCHOLOGIST_ROOM, text=text)
+    text = "I ended the conversation, because nobody wrote anything for {} minutes.".format(max(1, idle_reaper.timeout // 60))
+    relay_executor.submit(user_id, albums.flush, user_id)
+    relay_executor.submit(user_id, context.bot.send_message, chat_id=conversation.worker.user_id, text=text)
+    relay_executor.submit(user_id, context.bot.send_message, chat_id=user_id,
+                          text=text + " You can always ask for help again with /start.")
+    worker_id = conversation.worker.user_id
+    assignments.worker_idle(context, worker_id, cases_handled(context, worker_id))
 
 
-def main():
-    """the main event loop"""
-    logger.info('Starting corona telegram-bot')
+def forbidden_handler(update: Update, context: Context):
+    update.message.reply_text("Sorry, I can't handle that type of messages!")
 
-    updater = Updater(token=settings.TELEGRAM_BOT_TOKEN, use_context=True)
-    dispatcher = updater.dispatcher
 
+def alert_waiting_request(context, req, waiting_minutes):
+    """Highlights a user waiting for longer than waiting_minutes on the queue board"""
+    case_boards[req.type].update(context.job_queue)
+
+
+escalations = Escalations(alert_waiting_request, settings.ESCALATION_TIERS)
+reports = ReportStore(settings.REPORT_BLOCK_THRESHOLD)
+throttle = SenderThrottle({MESSAGE: (settings.THROTTLE_MESSAGE_RATE, settings.THROTTLE_MESSAGE_BURST),
+                           COMMAND: (settings.THROTTLE_COMMAND_RATE, settings.THROTTLE_COMMAND_BURST),
+                           CALLBACK: (settings.THROTTLE_CALLBACK_RATE, settings.THROTTLE_CALLBACK_BURST)},
+                          settings.THROTTLE_MAX_SENDERS)
+idle_reaper = IdleReaper(expire_conversation, settings.CONVERSATION_IDLE_TIMEOUT)
+assignments = Assignments(offer_case, broadcast_request, offer_expired, settings.ASSIGN_ACCEPT_TIMEOUT)
+case_boards = {
+    ConversationType.MEDICAL: QueueBoard(settings.TELEGRAM_DOCTOR_ROOM, lambda: render_case_board(ConversationType.MEDICAL),
+                                         settings.QUEUE_BOARD_DELAY, settings.QUEUE_BOARD_MIN_INTERVAL),
+    ConversationType.SOCIAL: QueueBoard(settings.TELEGRAM_PSYCHOLOGIST_ROOM, lambda: render_case_board(ConversationType.SOCIAL),
+                                        settings.QUEUE_BOARD_DELAY, settings.QUEUE_BOARD_MIN_INTERVAL),
+}
+new_members_board = QueueBoard(settings.TELEGRAM_NEW_MEMBERS_ROOM, render_new_members_board,
+                               settings.QUEUE_BOARD_DELAY, settings.QUEUE_BOARD_MIN_INTERVAL)
+
+
+# Actions the flows in FLOWS_DIR may use
+flow_actions = {
+    "admit_user": admit_user,
+    "doctors_room": doctors_room,
+    "psychologists_room": psychologists_room,
+    "new_members_room": new_members_room,
+}
+
+
+def refresh_bot_identity(context):
+    bot_identity.refresh(context.bot)
+
+
+def register_handlers(dispatcher):
+    """Registers all handlers of the bot, shared by main() and the benchmarks"""
+    # Drops the updates of blocked users before any other handler looks at them
+    dispatcher.add_handler(BlockedUserHandler(reports, drop_blocked_update), group=-1)
+    # Spam would otherwise run through the handlers and use up the Bot API limits shared by all conversations
+    dispatcher.add_handler(ThrottledUpdateHandler(throttle, drop_throttled_update), group=-1)
     dispatcher.add_handler(CommandHandler("start", deeplink, Filters.regex(r"doctor_\d+$")))
     dispatcher.add_handler(CommandHandler("start", deeplink, Filters.regex(r"psychologist_\d+$")))
-    dispatcher.add_handler(conv_handler)
-    dispatcher.add_handler(demo_conv_handler)
+    for flow in load_flows(settings.FLOWS_DIR, flow_actions):
+        handler = flow.conversation_handler(persistent=bool(settings.JOURNAL_PATH))
+        dispatcher.add_handler(handler)
+        # Users who abandon a flow would otherwise keep their state forever
+        bound_conversations(handler, settings.FLOW_STATE_MAX_SIZE, settings.FLOW_STATE_TTL)
     dispatcher.add_handler(CallbackQueryHandler(report_handler, pattern=r"^report_\d+$"))
+    dispatcher.add_handler(CallbackQueryHandler(offer_handler, pattern=r"^(accept|decline)_\d+$"))
+    dispatcher.add_handler(CommandHandler("available", available_handler, Filters.private))
+    dispatcher.add_handler(CommandHandler("away", away_handler, Filters.private))
+    dispatcher.add_handler(CommandHandler("unblock", unblock_handler, Filters.group))
     dispatcher.add_handler(CommandHandler("stop", stop_conversation))
 
-    # Handle chats between workers and users
-    dispatcher.add_handler(MessageHandler(Filters.text & Filters.private, chat_text_handler))
+    # Relay the messages between workers and users, all kinds which are not enabled are rejected
+    router = MessageRouter(forbidden_handler)
+    for conversation_type in ConversationType:
+        router.add_route(conversation_type, MessageKind.TEXT, chat_text_handler)
 
     if settings.CHAT_MEDICAL_ENABLE_PHOTOS:
-        dispatcher.add_handler(MessageHandler(filters.medical & Filters.private & Filters.photo, chat_photo_handler))
+        router.add_route(ConversationType.MEDICAL, MessageKind.PHOTO, chat_photo_handler)
     if settings.CHAT_MEDICAL_ENABLE_GIFS:
-        dispatcher.add_handler(MessageHandler(filters.medical & Filters.private & Filters.animation, chat_gif_handler))
+        router.add_route(ConversationType.MEDICAL, MessageKind.ANIMATION, chat_gif_handler)
     if settings.CHAT_MEDICAL_ENABLE_VOICE:
-        dispatcher.add_handler(MessageHandler(filters.medical & Filters.private & Filters.voice, chat_voice_handler))
+        router.add_route(ConversationType.MEDICAL, MessageKind.VOICE, chat_voice_handler)
+    if settings.CHAT_MEDICAL_ENABLE_VIDEOS:
+        router.add_route(ConversationType.MEDICAL, MessageKind.VIDEO, chat_media_handler)
+    if settings.CHAT_MEDICAL_ENABLE_DOCUMENTS:
+        router.add_route(ConversationType.MEDICAL, MessageKind.DOCUMENT, chat_media_handler)
 
     if settings.CHAT_SOCIAL_ENABLE_PHOTOS:
-        dispatcher.add_handler(MessageHandler(filters.social & Filters.private & Filters.photo, chat_photo_handler))
+        router.add_route(ConversationType.SOCIAL, MessageKind.PHOTO, chat_photo_handler)
     if settings.CHAT_SOCIAL_ENABLE_GIFS:
-        dispatcher.add_handler(MessageHandler(filters.social & Filters.private & Filters.animation, chat_gif_handler))
+        router.add_route(ConversationType.SOCIAL, MessageKind.ANIMATION, chat_gif_handler)
     if settings.CHAT_SOCIAL_ENABLE_VOICE:
-        dispatcher.add_handler(MessageHandler(filters.social & Filters.private & Filters.voice, chat_voice_handler))
+        router.add_route(ConversationType.SOCIAL, MessageKind.VOICE, chat_voice_handler)
+    if settings.CHAT_SOCIAL_ENABLE_VIDEOS:
+        router.add_route(ConversationType.SOCIAL, MessageKind.VIDEO, chat_media_handler)
+    if settings.CHAT_SOCIAL_ENABLE_DOCUMENTS:
+        router.add_route(ConversationType.SOCIAL, MessageKind.DOCUMENT, chat_media_handler)
+
+    dispatcher.add_handler(MessageHandler(Filters.private, router.route_message))
+
 
-    # Handle all the message types, which are not allowed:
-    dispatcher.add_handler(MessageHandler(~Filters.text & Filters.private, forbidden_handler))
+def bound_context_data(dispatcher):
+    """Replaces user_data and chat_data with ExpiringDicts unless the persistence provided one already"""
+    if not isinstance(dispatcher.user_data, ExpiringDict):
+        dispatcher.user_data = ExpiringDict(dict, settings.USER_DATA_MAX_SIZE, settings.USER_DATA_TTL, data=dispatcher.user_data)
+    if not isinstance(dispatcher.chat_data, ExpiringDict):
+        dispatcher.chat_data = ExpiringDict(dict, settings.USER_DATA_MAX_SIZE, settings.USER_DATA_TTL, data=dispatcher.chat_data)
 
-    # Schedule jobs to run periodically in the background
-    job_queue = updater.job_queue
-    job_queue.run_repeating(callback=check_waiting_conversations, interval=60, first=60)
 
-    updater.start_polling()
+def expire_context_data(context):
+    for name, store in iter_context_stores(context.dispatcher):
+        store.expire()
+    throttle.expire()
+
+
+def count_update(update, context):
+    updates_received.inc()
+
+
+def compact_journal(context):
+    context.job.context.compact()
+
+
+def start_webhook(updater):
+    """Receives updates through a webhook instead of long polling.
+
+    TLS is expected to be terminated by a reverse proxy forwarding WEBHOOK_URL to WEBHOOK_LISTEN:WEBHOOK_PORT."""
+    url_path = settings.WEBHOOK_URL.rsplit("/", 1)[-1]
+    updater.start_webhook(listen=settings.WEBHOOK_LISTEN, port=settings.WEBHOOK_PORT, url_path=url_path)
+
+    certificate = None
+    if settings.CERTPATH and os.path.exists(settings.CERTPATH):
+        certificate = open(settings.CERTPATH, "rb")
+    try:
+        updater.bot.set_webhook(url=settings.WEBHOOK_URL, certificate=certificate, max_connections=settings.WEBHOOK_MAX_CONNECTIONS)
+    finally:
+        if certificate is not None:
+            certificate.close()
+    logger.info("Receiving updates via webhook on port {}".format(settings.WEBHOOK_PORT))
+
+
+def main():
+    """the main event loop"""
+    log_listener = setup_logging(settings.LOGGER_CONFIG, settings.LOG_QUEUE_SIZE)
+    logger.info('Starting corona telegram-bot')
+
+    # All outgoing messages pass the flood limit aware send queue. The connection pool is shared by the send queue workers,
+    # the dispatcher workers and the updater's own threads
+    request = InstrumentedRequest(api_latency, flood_errors, con_pool_size=settings.SEND_QUEUE_WORKERS + 8)
+    bot = QueuedBot(settings.TELEGRAM_BOT_TOKEN, request=request, send_queue=send_queue)
+
+    # The update queue is bounded, which applies backpressure when the handlers fall behind. The poller waits for room,
+    # the webhook rejects updates with 503 until there is room again, so that Telegram delivers them later
+    if settings.USE_WEBHOOK:
+        update_queue = WebhookUpdateQueue(settings.UPDATE_QUEUE_SIZE, settings.UPDATE_QUEUE_PUT_TIMEOUT)
+        metrics.callback_counter("bot_webhook_rejected_updates_total", "Webhook updates rejected, because the update queue was full",
+                                 func=lambda: update_queue.rejected)
+    else:
+        update_queue = Queue(maxsize=settings.UPDATE_QUEUE_SIZE)
+    job_queue = JobQueue()
+
+    # Restore the state of the last run and journal all further changes
+    persistence = None
+    if settings.STATE_BACKEND == "sqlite":
+        # Requests and conversations are shared with the other bot processes using the same database
+        conversations.use_backend(SQLiteBackend(settings.STATE_DB_PATH))
+    if settings.JOURNAL_PATH:
+        journal = Journal(settings.JOURNAL_PATH)
+        state = journal.load()
+        if isinstance(conversations.backend, MemoryBackend):
+            conversations.backend.attach_journal(journal, state)
+        reports.attach_journal(journal, state)
+        persistence = JournalPersistence(journal, state, settings.USER_DATA_MAX_SIZE, settings.USER_DATA_TTL)
+        job_queue.run_repeating(callback=compact_journal, interval=settings.JOURNAL_COMPACT_INTERVAL,
+                                first=settings.JOURNAL_COMPACT_INTERVAL, context=journal)
+    logger.info("Restored {} waiting requests and {} conversations".format(conversations.count_waiting_requests(),
+                                                                         conversations.count_active_conversations()))
+
+    dispatcher = Dispatcher(bot, update_queue, job_queue=job_queue, persistence=persistence, use_context=True)
+    job_queue.set_dispatcher(dispatcher)
+    updater = Updater(dispatcher=dispatcher, workers=None, use_context=True)
+    bot_identity.refresh(updater.bot)
+
+    bound_context_data(dispatcher)
+    register_handlers(dispatcher)
+    instrument_handlers(dispatcher, lambda name, seconds: handler_latency.observe(seconds, (name,)))
+    # Counts the dropped updates of blocked users as well
+    dispatcher.add_handler(TypeHandler(Update, count_update), group=-2)
+    metrics.gauge("bot_update_queue_depth", "Updates waiting for the dispatcher", func=update_queue.qsize)
+    metrics.gauge("bot_context_entries", "Entries of user_data, chat_data and the flow states", ["store"],
+                  func=lambda: {(name,): len(store) for name, store in iter_context_stores(dispatcher)})
+    metrics.callback_counter("bot_context_evictions_total", "Entries evicted from user_data, chat_data and the flow states",
+                             labelnames=["store"], func=lambda: {(name,): store.evicted for name, store in iter_context_stores(dispatcher)})
+    metrics.callback_counter("bot_throttled_updates_total", "Updates dropped, because their sender exceeded its limits",
+                             func=lambda: throttle.throttled)
+    metrics.gauge("bot_throttle_buckets", "Senders with a token bucket", func=lambda: len(throttle))
+    metrics.gauge("bot_blocked_users", "Users blocked after reports", func=lambda: len(reports))
+    metrics.gauge("bot_idle_workers", "Available workers waiting for a case", func=assignments.count_idle)
+    metrics.callback_counter("bot_queue_board_edits_total", "Edits of the queue boards of the rooms", labelnames=["room"],
+                             func=lambda: {(str(board.chat_id),): board.edits for board in (*case_boards.values(), new_members_board)})
+
+    for req in conversations.iter_waiting_requests():
+        escalations.arm(job_queue, req)
+    for conversation in conversations.iter_active_conversations():
+        idle_reaper.watch(job_queue, conversation)
+
+    # The boards are kept across restarts, their message ids are kept in bot_data
+    message_ids = dispatcher.bot_data.setdefault("queue_boards", dict())
+    for board in (*case_boards.values(), new_members_board):
+        board.attach(message_ids)
+    job_queue.run_repeating(callback=update_boards, interval=settings.QUEUE_BOARD_REFRESH_INTERVAL, first=0)
+
+    job_queue.run_repeating(callback=expire_context_data, interval=settings.CONTEXT_EXPIRE_INTERVAL,
+                            first=settings.CONTEXT_EXPIRE_INTERVAL)
+
+    # Pick up renames of the bot without a get_me() call per forwarded case
+    updater.job_queue.run_repeating(callback=refresh_bot_identity, interval=settings.BOT_IDENTITY_REFRESH_INTERVAL,
+                                    first=settings.BOT_IDENTITY_REFRESH_INTERVAL)
+
+    metrics_server = None
+    if settings.METRICS_PORT:
+        metrics_server = MetricsServer(metrics, settings.METRICS_LISTEN, settings.METRICS_PORT)
+        metrics_server.start()
+
+    send_queue.start()
+    relay_executor.start()
+    if settings.USE_WEBHOOK:
+        start_webhook(updater)
+    else:
+        updater.start_polling()
     updater.idle()
+    relay_executor.stop()
+    send_queue.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+    log_listener.stop()
 
 
 if __name__ == "__main__":
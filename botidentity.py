@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from telegram.utils import helpers
+
+logger = logging.getLogger(__name__)
+
+
+class BotIdentity(object):
+    """Caches the bot's own id and username, so that building deep links doesn't need a get_me() round trip"""
+    __instance = None
+    _initialized = False
+
+    def __init__(self):
+        if BotIdentity._initialized:
+            return
+        self.id = None
+        self.username = None
+        self._start_url = None
+        BotIdentity._initialized = True
+
+    def __new__(cls):
+        if cls.__instance is None:
+            cls.__instance = super(BotIdentity, cls).__new__(cls)
+        return cls.__instance
+
+    def refresh(self, bot):
+        """Fetches the bot's identity from Telegram and rebuilds the precomputed urls if the bot has been renamed"""
+        me = bot.get_me()
+        if me.id == self.id and me.username == self.username:
+            return
+
+        if self.username is not None:
+            logger.info("Bot has been renamed from @{} to @{}".format(self.username, me.username))
+        self.id = me.id
+        self.username = me.username
+        self._start_url = helpers.create_deep_linked_url(me.username) + "?start="
+
+    def deep_link(self, payload):
+        """Returns the deep link starting the bot with payload. Payloads are built internally from user ids and are not validated"""
+        if self._start_url is None:
+            raise RuntimeError("BotIdentity has not been refreshed yet")
+        return self._start_url + payload
+
+    def assign_url(self, room_type, user_id):
+        """Returns the deep link used by a worker to claim the case of user_id"""
+        return self.deep_link("{}_{}".format(room_type, user_id))
+
+    @staticmethod
+    def report_callback_data(user_id):
+        return "report_{}".format(user_id)
+
+    @staticmethod
+    def accept_callback_data(user_id):
+        return "accept_{}".format(user_id)
+
+    @staticmethod
+    def decline_callback_data(user_id):
+        return "decline_{}".format(user_id)
@@ -20,17 +20,121 @@ TELEGRAM_DOCTOR_ROOM = os.getenv("TELEGRAM_DOCTOR_ROOM")
 TELEGRAM_PSYCHOLOGIST_ROOM = os.getenv("TELEGRAM_PSYCHOLOGIST_ROOM")
 TELEGRAM_NEW_MEMBERS_ROOM = os.getenv("TELEGRAM_NEW_MEMBERS_ROOM")
 
+# Minutes after which a waiting user is highlighted on the queue board of the room
+ESCALATION_TIERS = [int(minutes) for minutes in os.getenv("ESCALATION_TIERS", "15,30,60").split(",")]
+
+# Seconds an available worker has to accept an offered case, before the case is broadcast to the room
+ASSIGN_ACCEPT_TIMEOUT = int(os.getenv("ASSIGN_ACCEPT_TIMEOUT", 30))
+
+# Queue boards - every room has one pinned message listing its waiting cases instead of one message per case. A change is
+# shown after QUEUE_BOARD_DELAY seconds, but at most one edit per QUEUE_BOARD_MIN_INTERVAL seconds is sent, all changes in
+# between are shown by the same edit. The wait times are refreshed every QUEUE_BOARD_REFRESH_INTERVAL seconds. A board lists
+# up to QUEUE_BOARD_MAX_CASES cases
+QUEUE_BOARD_DELAY = float(os.getenv("QUEUE_BOARD_DELAY", 2))
+QUEUE_BOARD_MIN_INTERVAL = float(os.getenv("QUEUE_BOARD_MIN_INTERVAL", 5))
+QUEUE_BOARD_REFRESH_INTERVAL = int(os.getenv("QUEUE_BOARD_REFRESH_INTERVAL", 60))
+QUEUE_BOARD_MAX_CASES = int(os.getenv("QUEUE_BOARD_MAX_CASES", 20))
+
+# Seconds between checks whether the bot has been renamed
+BOT_IDENTITY_REFRESH_INTERVAL = int(os.getenv("BOT_IDENTITY_REFRESH_INTERVAL", 3600))
+
+# Outbound messages - Telegram allows about 30 messages per second overall and 20 messages per minute per group
+SEND_QUEUE_WORKERS = int(os.getenv("SEND_QUEUE_WORKERS", 4))
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))
+SEND_PRIVATE_RATE = float(os.getenv("SEND_PRIVATE_RATE", 1))
+SEND_PRIVATE_BURST = int(os.getenv("SEND_PRIVATE_BURST", 3))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", 20 / 60))
+SEND_GROUP_BURST = int(os.getenv("SEND_GROUP_BURST", 20))
+
+# Admission - new users are admitted while their expected wait is below ADMISSION_WARN_WAIT seconds, warned about the wait
+# below ADMISSION_MAX_WAIT and asked to come back later beyond. The wait is estimated from the rates at which requests are
+# claimed and conversations end, averaged over about ADMISSION_RATE_WINDOW seconds
+ADMISSION_WARN_WAIT = int(os.getenv("ADMISSION_WARN_WAIT", 600))
+ADMISSION_MAX_WAIT = int(os.getenv("ADMISSION_MAX_WAIT", 3600))
+ADMISSION_RATE_WINDOW = int(os.getenv("ADMISSION_RATE_WINDOW", 900))
+
+# Users reported by REPORT_BLOCK_THRESHOLD workers are blocked, all their updates are dropped. /unblock <user id> in one of
+# the rooms lifts the block
+REPORT_BLOCK_THRESHOLD = int(os.getenv("REPORT_BLOCK_THRESHOLD", 2))
+
+# Inbound limits per sender - every user has a token bucket per kind of update, which allows bursts of *_BURST updates
+# and *_RATE updates per second on average. Further updates are dropped and the user is told once. A rate of 0 disables
+# the limit. Messages include the items of albums, which arrive at once. Buckets are kept for up to THROTTLE_MAX_SENDERS users
+THROTTLE_MESSAGE_RATE = float(os.getenv("THROTTLE_MESSAGE_RATE", 1))
+THROTTLE_MESSAGE_BURST = int(os.getenv("THROTTLE_MESSAGE_BURST", 20))
+THROTTLE_COMMAND_RATE = float(os.getenv("THROTTLE_COMMAND_RATE", 0.2))
+THROTTLE_COMMAND_BURST = int(os.getenv("THROTTLE_COMMAND_BURST", 5))
+THROTTLE_CALLBACK_RATE = float(os.getenv("THROTTLE_CALLBACK_RATE", 1))
+THROTTLE_CALLBACK_BURST = int(os.getenv("THROTTLE_CALLBACK_BURST", 10))
+THROTTLE_MAX_SENDERS = int(os.getenv("THROTTLE_MAX_SENDERS", 100000))
+
+# Seconds after which a conversation without any message is ended, 0 keeps conversations until /stop. Every process only
+# sees the messages it relays, so with the sqlite backend a conversation may end while the side served by another process writes
+CONVERSATION_IDLE_TIMEOUT = int(os.getenv("CONVERSATION_IDLE_TIMEOUT", 3600))
+
 # Chat settings
+# Number of threads relaying chat messages, messages of one conversation are always relayed by the same thread.
+# 0 relays on the dispatcher thread.
+RELAY_WORKERS = int(os.getenv("RELAY_WORKERS", 8))
+
 CHAT_SOCIAL_ENABLE_GIFS = os.getenv("CHAT_SOCIAL_ENABLE_GIFS", True)
 CHAT_SOCIAL_ENABLE_PHOTOS = os.getenv("CHAT_SOCIAL_ENABLE_PHOTOS", True)
 CHAT_SOCIAL_ENABLE_VOICE = os.getenv("CHAT_SOCIAL_ENABLE_VOICE", True)
+CHAT_SOCIAL_ENABLE_VIDEOS = os.getenv("CHAT_SOCIAL_ENABLE_VIDEOS", "").lower() in ("1", "true", "yes")
+CHAT_SOCIAL_ENABLE_DOCUMENTS = os.getenv("CHAT_SOCIAL_ENABLE_DOCUMENTS", "").lower() in ("1", "true", "yes")
 
 CHAT_MEDICAL_ENABLE_GIFS = os.getenv("CHAT_MEDICAL_ENABLE_GIFS", True)
 CHAT_MEDICAL_ENABLE_PHOTOS = os.getenv("CHAT_MEDICAL_ENABLE_PHOTOS", True)
 CHAT_MEDICAL_ENABLE_VOICE = os.getenv("CHAT_MEDICAL_ENABLE_VOICE", True)
+CHAT_MEDICAL_ENABLE_VIDEOS = os.getenv("CHAT_MEDICAL_ENABLE_VIDEOS", "").lower() in ("1", "true", "yes")
+CHAT_MEDICAL_ENABLE_DOCUMENTS = os.getenv("CHAT_MEDICAL_ENABLE_DOCUMENTS", "").lower() in ("1", "true", "yes")
+
+# Seconds to wait for further items of an album before relaying it as one media group
+ALBUM_COLLECT_DELAY = float(os.getenv("ALBUM_COLLECT_DELAY", 1.0))
+
+# State backend - "memory" keeps requests and conversations in this process, "sqlite" shares them through STATE_DB_PATH
+# with all bot processes on this host, e.g. several processes behind a webhook splitter routing each user to one process
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", str(Path(ROOT_DIR) / "data" / "shared.sqlite3"))
+
+# Persistence - Requests, conversations, reports and user data are journaled to this SQLite database, an empty path disables it
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", str(Path(ROOT_DIR) / "data" / "state.sqlite3"))
+# Seconds between compactions of the journal into a snapshot
+JOURNAL_COMPACT_INTERVAL = int(os.getenv("JOURNAL_COMPACT_INTERVAL", 300))
+
+# Logging - configured from LOGGER_CONFIG, records are written by a background thread from a queue of LOG_QUEUE_SIZE records.
+# Records are dropped while the queue is full
+LOGGER_CONFIG = os.getenv("LOGGER_CONFIG", str(Path(ROOT_DIR) / "config" / "logger.yaml"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# Metrics - Prometheus text format served on http://METRICS_LISTEN:METRICS_PORT/metrics, port 0 disables it
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 8000))
+
+# Context data - user_data and chat_data keep up to USER_DATA_MAX_SIZE entries, entries of users who haven't been seen
+# for USER_DATA_TTL seconds are evicted. The states of the flows are bounded alike, users who don't answer within
+# FLOW_STATE_TTL seconds have to start over. The per-worker case counts are kept in bot_data, which isn't evicted
+USER_DATA_MAX_SIZE = int(os.getenv("USER_DATA_MAX_SIZE", 100000))
+USER_DATA_TTL = int(os.getenv("USER_DATA_TTL", 86400))
+FLOW_STATE_MAX_SIZE = int(os.getenv("FLOW_STATE_MAX_SIZE", 100000))
+FLOW_STATE_TTL = int(os.getenv("FLOW_STATE_TTL", 3600))
+# Seconds between the evictions of expired entries
+CONTEXT_EXPIRE_INTERVAL = int(os.getenv("CONTEXT_EXPIRE_INTERVAL", 60))
+
+# Conversation flows - every .yaml file in FLOWS_DIR defines a flow, see flow.py. They are checked in file name order
+FLOWS_DIR = os.getenv("FLOWS_DIR", str(Path(ROOT_DIR) / "flows"))
 
 # Webhook configuration - If set to false we use long polling
-USE_WEBHOOK = False
-WEBHOOK_PORT = 9001
-WEBHOOK_URL = "https://domain.example.com/" + TELEGRAM_BOT_TOKEN
-CERTPATH = "/etc/certs/example.com/fullchain.cer"
+USE_WEBHOOK = os.getenv("USE_WEBHOOK", "False").lower() in ("1", "true", "yes")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 9001))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "https://domain.example.com/") + TELEGRAM_BOT_TOKEN
+CERTPATH = os.getenv("CERTPATH", "/etc/certs/example.com/fullchain.cer")
+# Maximum number of simultaneous webhook connections Telegram opens to deliver updates
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+
+# Number of updates buffered for the dispatcher. Once full, the poller stops fetching and the webhook answers 503 until the
+# handlers caught up, so Telegram keeps the backlog instead of us
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 1000))
+# Seconds the webhook waits for room in a full update queue before answering 503, it blocks all webhook connections meanwhile
+UPDATE_QUEUE_PUT_TIMEOUT = float(os.getenv("UPDATE_QUEUE_PUT_TIMEOUT", 0.1))
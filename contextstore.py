@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import defaultdict
+from itertools import islice
+
+from telegram.ext import ConversationHandler
+
+
+class ExpiringDict(defaultdict):
+    """defaultdict which drops the entries not accessed for `ttl` seconds and the least recently used ones beyond `maxsize`.
+
+    It's a defaultdict, so the Dispatcher accepts it as user_data and chat_data. The access times are kept in a second dict
+    in access order, every access moves the key to its end. Expired and surplus entries are therefore always at the front
+    and evicting costs O(1) per evicted entry. on_evict(key, value) is called for every evicted entry, e.g. to drop it from
+    the persistence."""
+
+    def __init__(self, default_factory=None, maxsize=100000, ttl=86400, on_evict=None, data=()):
+        super(ExpiringDict, self).__init__(default_factory)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.evicted = 0
+        # key -> time.monotonic() of the last access, oldest first
+        self._accessed = dict()
+        self._lock = threading.RLock()
+        for key, value in data.items() if isinstance(data, dict) else data:
+            self[key] = value
+
+    def _touch(self, key):
+        self._accessed.pop(key, None)
+        self._accessed[key] = time.monotonic()
+
+    def __getitem__(self, key):
+        with self._lock:
+            if dict.__contains__(self, key):
+                self._touch(key)
+                return dict.__getitem__(self, key)
+            # Calls __missing__, which inserts the default value through __setitem__
+            return super(ExpiringDict, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            dict.__setitem__(self, key, value)
+            self._touch(key)
+            self._evict_surplus()
+
+    def __delitem__(self, key):
+        with self._lock:
+            dict.__delitem__(self, key)
+            self._accessed.pop(key, None)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if not dict.__contains__(self, key):
+                return default
+            self._touch(key)
+            return dict.__getitem__(self, key)
+
+    def pop(self, key, *default):
+        with self._lock:
+            self._accessed.pop(key, None)
+            return dict.pop(self, key, *default)
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            if not dict.__contains__(self, key):
+                self[key] = default
+            return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        with self._lock:
+            dict.clear(self)
+            self._accessed.clear()
+
+    def _evict(self, key):
+        value = dict.pop(self, key, None)
+        del self._accessed[key]
+        self.evicted += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def _evict_surplus(self):
+        while len(self._accessed) > self.maxsize:
+            self._evict(next(iter(self._accessed)))
+
+    def expire(self):
+        """Evicts the entries which haven't been accessed for ttl seconds, returns their number"""
+        deadline = time.monotonic() - self.ttl
+        expired = 0
+        with self._lock:
+            for key, accessed in self._accessed.items():
+                if accessed > deadline:
+                    break
+                expired += 1
+            for key in list(islice(self._accessed, expired)):
+                self._evict(key)
+        return expired
+
+
+def bound_conversations(handler, maxsize, ttl):
+    """Replaces the conversations of a ConversationHandler, e.g. of a flow, with an ExpiringDict.
+
+    Has to be called after the handler has been added to the dispatcher, which sets the conversations of persistent
+    handlers. Evicted states are dropped from the persistence."""
+
+    def drop(key, state):
+        if handler.persistent:
+            handler.persistence.update_conversation(handler.name, key, None)
+
+    handler.conversations = ExpiringDict(None, maxsize, ttl, on_evict=drop, data=handler.conversations)
+    return handler.conversations
+
+
+def iter_context_stores(dispatcher):
+    """Yields (name, store) for the ExpiringDicts of the dispatcher and its ConversationHandlers"""
+    for name in ("user_data", "chat_data"):
+        store = getattr(dispatcher, name)
+        if isinstance(store, ExpiringDict):
+            yield name, store
+    for group in dispatcher.groups:
+        for handler in dispatcher.handlers[group]:
+            if isinstance(handler, ConversationHandler) and isinstance(handler.conversations, ExpiringDict):
+                yield "conversation:{}".format(handler.name), handler.conversations
@@ -2,6 +2,7 @@
 
 
 class Conversation(object):
+    __slots__ = ("worker", "user", "type")
 
     def __init__(self, worker, user, type):
         if worker == user:
@@ -9,6 +9,7 @@ class ConversationType(IntEnum):
 
 
 class ConversationRequest(object):
+    __slots__ = ("user", "type", "waiting_since")
 
     def __init__(self, user, type: ConversationType):
         self.user = user
@@ -1,49 +1,92 @@
 # -*- coding: utf-8 -*-
+import heapq
 import time
 
 from conversationrequest import ConversationRequest
+from waitingline import WaitingLine
 
 
 class ConversationRequests(object):
-    _requests = list()
+    """Queue of waiting ConversationRequests with one FIFO line per ConversationType"""
 
     def __init__(self):
-        pass
+        self._lines = dict()
+
+    def __len__(self):
+        return sum(len(line) for line in self._lines.values())
+
+    def __iter__(self):
+        """Iterates over all waiting requests, oldest first"""
+        return heapq.merge(*self._lines.values(), key=lambda req: req.waiting_since)
+
+    def count(self, type):
+        line = self._lines.get(type)
+        return 0 if line is None else len(line)
+
+    def iter_line(self, type):
+        """Iterates over the waiting requests of type, oldest first. The line must not change while it is iterated"""
+        return iter(self._lines.get(type, ()))
+
+    def snapshot(self):
+        """Iterates over a copy of the waiting requests, oldest first, which stays valid while the queue changes"""
+        return heapq.merge(*[list(line) for line in self._lines.values()], key=lambda req: req.waiting_since)
+
+    def _find_line(self, user_id):
+        for line in self._lines.values():
+            if user_id in line:
+                return line
+        return None
 
     def add(self, req: ConversationRequest):
-        if req in self._requests:
+        if self._find_line(req.user.user_id) is not None:
             raise Exception("User already waiting")
-        self._requests.append(req)
+        line = self._lines.get(req.type)
+        if line is None:
+            line = self._lines[req.type] = WaitingLine()
+        line.append(req)
+
+    def extend(self, reqs):
+        """Adds several requests at once, e.g. when restoring the queue. reqs must be ordered by waiting_since"""
+        by_type = dict()
+        for req in reqs:
+            if self._find_line(req.user.user_id) is not None:
+                raise Exception("User already waiting")
+            by_type.setdefault(req.type, []).append(req)
+
+        for type, type_reqs in by_type.items():
+            line = self._lines.get(type)
+            if line is None:
+                line = self._lines[type] = WaitingLine()
+            line.extend(type_reqs)
 
     def get_request_by_user(self, user_id):
-        for req in self._requests:
-            if req.user.user_id == user_id:
-                return req
-        return None
+        line = self._find_line(user_id)
+        if line is None:
+            return None
+        return line.get(user_id)
 
     def has_user_request(self, user_id):
-        return self.get_request_by_user(user_id) is not None
+        return self._find_line(user_id) is not None
+
+    def get_position(self, user_id):
+        """Returns the 1-based position of a user among the requests of the same type or None"""
+        line = self._find_line(user_id)
+        if line is None:
+            return None
+        return line.position(user_id)
 
     def close(self, req):
-        try:
-            self._requests.remove(req)
-        except ValueError:
-            pass
+        self.close_by_user(req.user.user_id)
 
     def close_by_user(self, user_id):
-        try:
-            req = self.get_request_by_user(user_id)
-            if req is not None:
-                self._requests.remove(req)
-        except ValueError:
-            pass
+        line = self._find_line(user_id)
+        if line is not None:
+            line.remove(user_id)
 
     def get_waiting_requests(self, waiting_minutes=15):
-        now = int(time.time())
-        tmp_reqs = list()
-        for req in self._requests:
-            time_diff = now - req.waiting_since
-            if time_diff >= waiting_minutes * 60:
-                tmp_reqs.append(req)
-
-        return tmp_reqs
+        return self.get_overdue_requests(int(time.time()) - waiting_minutes * 60)
+
+    def get_overdue_requests(self, deadline):
+        """Returns the requests waiting since deadline or earlier, oldest first"""
+        lines = [line.waiting_since(deadline) for line in self._lines.values()]
+        return list(heapq.merge(*lines, key=lambda req: req.waiting_since))
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 import time
 
-from conversation import Conversation
-from conversationrequests import ConversationRequests
+from admission import AdmissionController
+from backends import MemoryBackend
+from config import settings
 from conversationrequest import ConversationRequest
 from conversationrequest import ConversationType
 from user import User
@@ -11,13 +12,17 @@ from user import User
 class Conversations(object):
     __instance = None
     _initialized = False
-    LIMIT_CONCURRENT_CHATS = 100
 
     def __init__(self):
         if Conversations._initialized:
             return
-        self.conversation_requests = ConversationRequests()
-        self.active_conversations = []
+        self.backend = MemoryBackend()
+        self.admission = AdmissionController(tau=settings.ADMISSION_RATE_WINDOW,
+                                             warn_wait=settings.ADMISSION_WARN_WAIT,
+                                             max_wait=settings.ADMISSION_MAX_WAIT)
+        # Number of reads of a single user's request or conversation, exported as bot_registry_lookups_total to compare
+        # against the number of processed updates
+        self.lookups = 0
         Conversations._initialized = True
 
     def __new__(cls):
@@ -25,16 +30,51 @@ class Conversations(object):
             cls.__instance = super(Conversations, cls).__new__(cls)
         return cls.__instance
 
-    def limit_reached(self):
-        """Returns True if the number of current active conversations exceed the defined limit"""
-        return len(self.active_conversations) >= Conversations.LIMIT_CONCURRENT_CHATS
+    def use_backend(self, backend):
+        """Replaces the StateBackend, must be called before any request or conversation is created"""
+        self.backend = backend
+
+    def admit(self):
+        """Returns the Admission of a new user and the wait it can expect in seconds, None while unknown"""
+        return self.admission.decide(self.backend.count_requests())
 
     def is_user_waiting(self, user_id):
-        return self.conversation_requests.has_user_request(user_id)
+        return self.get_request(user_id) is not None
+
+    def get_request(self, user_id):
+        """Returns the waiting ConversationRequest of a user or None"""
+        self.lookups += 1
+        return self.backend.get_request(user_id)
+
+    def get_queue_position(self, user_id):
+        """Returns the 1-based position of a waiting user among the requests of the same type"""
+        self.lookups += 1
+        return self.backend.get_request_position(user_id)
+
+    def count_waiting_requests(self, type=None):
+        return self.backend.count_requests(type)
+
+    def iter_waiting_requests(self):
+        """Iterates over all waiting requests, oldest first"""
+        return self.backend.iter_requests()
+
+    def find_waiting_requests(self, type, predicate=None, limit=None):
+        """Returns up to limit waiting requests of type for which predicate(req) is true, oldest first"""
+        return self.backend.find_requests(type, predicate, limit)
+
+    def get_oldest_request(self):
+        """Returns the request waiting the longest or None"""
+        return self.backend.get_oldest_request()
 
     def get_waiting_requests(self, waiting_minutes=15):
         """Returns a list of requests waiting for over 15 minutes"""
-        return self.conversation_requests.get_waiting_requests(waiting_minutes)
+        return self.backend.get_overdue_requests(int(time.time()) - waiting_minutes * 60)
+
+    def count_active_conversations(self):
+        return self.backend.count_conversations()
+
+    def iter_active_conversations(self):
+        return self.backend.iter_conversations()
 
     def has_active_conversation(self, user_id):
         """Checks if a user has active conversations"""
@@ -42,29 +82,34 @@ class Conversations(object):
 
     def get_conversation(self, user_id):
         """Returns the Conversation object for a certain user"""
-        for conv in self.active_conversations:
-            if conv.worker == user_id or conv.user == user_id:
-                return conv
-
-        return None
+        self.lookups += 1
+        return self.backend.get_conversation(user_id)
 
     def new_conversation(self, worker_id, user_id):
-        worker = User(worker_id)
-        user = User(user_id)
-
-        req = self.conversation_requests.get_request_by_user(user.user_id)
-
-        conv = Conversation(worker, user, req.type)
-        self.active_conversations.append(conv)
-
-        self.conversation_requests.close(req)
+        """Assigns the waiting user to the worker. Returns the new Conversation or None if the case has been claimed already"""
+        if int(worker_id) == int(user_id):
+            raise ValueError("Worker can't be the same as user")
+        conversation = self.backend.claim_request(int(worker_id), int(user_id))
+        if conversation is not None:
+            self.admission.record_claim()
+        return conversation
 
     def stop_conversation(self, user_id):
-        conv = self.get_conversation(user_id)
-        if conv is not None:
-            self.active_conversations.remove(conv)
+        """Ends the conversation of a worker or user. Returns it, or None if it has been ended already"""
+        conversation = self.backend.remove_conversation(user_id)
+        if conversation is not None:
+            self.admission.record_stop()
+        return conversation
+
+    def cancel_request(self, user_id):
+        """Removes the waiting request of a user, returns True if there was one"""
+        return self.backend.remove_request(user_id)
 
     def request_conversation(self, user_id, first_name, last_name, username, type):
+        """Puts the user in line. Returns the new ConversationRequest or None if the user is already waiting or in a conversation"""
         new_user = User(user_id, first_name, last_name, username)
         req = ConversationRequest(new_user, type)
-        self.conversation_requests.add(req)
+        if not self.backend.add_request(req):
+            return None
+        self.admission.record_arrival()
+        return req
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+from conversations import Conversations
+
+logger = logging.getLogger(__name__)
+
+
+class Escalations(object):
+    """Arms one deadline per waiting ConversationRequest and fires each escalation tier exactly once.
+
+    Only the next tier of a request is scheduled on the JobQueue at any time. When it fires, the alert callback is called
+    and the following tier is armed. Claiming or cancelling a request removes its pending job, so the work done depends on
+    the number of expiring requests and not on the length of the queue."""
+
+    def __init__(self, alert_callback, tiers):
+        """alert_callback is called as alert_callback(context, req, waiting_minutes)"""
+        self.alert_callback = alert_callback
+        self.tiers = sorted(tiers)
+        self._jobs = dict()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def arm(self, job_queue, req):
+        """Schedules the next escalation tier of a request, which has not yet been reached"""
+        self.cancel(req.user.user_id)
+
+        now = time.time()
+        for minutes in self.tiers:
+            due = req.waiting_since + minutes * 60
+            if due > now:
+                job = job_queue.run_once(self._escalate, due - now, context=(req, minutes), name="escalation_{}".format(req.user.user_id))
+                self._jobs[req.user.user_id] = job
+                return
+
+    def cancel(self, user_id):
+        """Removes the pending escalation of a user, e.g. once the case has been claimed"""
+        job = self._jobs.pop(user_id, None)
+        if job is not None:
+            job.schedule_removal()
+
+    def _escalate(self, context):
+        req, minutes = context.job.context
+        user_id = req.user.user_id
+        if self._jobs.get(user_id) is context.job:
+            del self._jobs[user_id]
+
+        # The request might have been claimed or replaced by a newer one in the meantime
+        current = Conversations().get_request(user_id)
+        if current is None or current.waiting_since != req.waiting_since:
+            return
+
+        try:
+            self.alert_callback(context, req, minutes)
+        except Exception:
+            logger.exception("Could not escalate waiting request of user {}".format(user_id))
+
+        self.arm(context.job_queue, req)
@@ -1,4 +0,0 @@
-# -*- coding: utf-8 -*-
-from .conversationfilter import ConversationTypeFilter, medical, social
-
-__all__ = ["ConversationTypeFilter", "medical", "social"]
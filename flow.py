@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Conversation flows defined in YAML files and compiled into ConversationHandlers.
+
+A flow file looks like this:
+
+    name: triage                # name of the ConversationHandler, used for persistence
+    entry:
+      command: start            # command starting the flow
+      action: admit_user        # optional, ends the flow if it returns False
+    greeting: Hello there.      # optional, sent before the first prompt
+    start: feel_ok              # first state
+    cancel:
+      commands: [cancel]        # commands ending the flow
+      prompt: Bye!
+    invalid: Sorry, but that's not any of the expected answers.
+    states:
+      feel_ok:
+        prompt: Are you feeling Ok?
+        answers:                # choice: answer text -> next state, shown as keyboard if no keyboard is given
+          "Yes": describe
+          "No": bye
+      describe:
+        prompt: Please describe your symptoms.
+        keyboard: remove        # list of button rows, or remove
+        input: text             # free answer of a MessageKind, e.g. text or photo
+        action: doctors_room    # optional, called with the answer
+        next: bye               # optional, the flow ends after the action otherwise
+        invalid: Please send a text!
+      bye:
+        prompt: Bye!            # states without answers and input end the flow
+
+Actions are plain handler callbacks, passed by name to Flow.
+"""
+import os
+from functools import wraps
+
+import yaml
+from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.ext import CommandHandler, MessageHandler, Filters, ConversationHandler
+
+from messagerouter import MessageKind, message_kind
+
+
+class FlowState(object):
+    """A compiled state of a Flow. Instances are the callbacks of the state's handler"""
+
+    def __init__(self, flow, name, definition):
+        self.flow = flow
+        self.name = name
+        # Name of the callback, e.g. for the handler latency metrics
+        self.__name__ = "{}.{}".format(flow.name, name)
+        prompt = definition["prompt"]
+        self.prompts = prompt if isinstance(prompt, list) else [prompt]
+        self.invalid = definition.get("invalid", flow.invalid)
+        self.action = flow.action(definition.get("action"))
+        self.next = definition.get("next")
+
+        self.answers = dict()
+        for answer, target in definition.get("answers", dict()).items():
+            if not isinstance(answer, str):
+                raise ValueError("Answer {!r} of state {} isn't a string, it has to be quoted".format(answer, self.__name__))
+            self.answers[answer] = target
+
+        self.input = None
+        if "input" in definition:
+            self.input = MessageKind(definition["input"])
+        if self.answers and self.input is not None:
+            raise ValueError("State {} can't have answers and an input".format(self.__name__))
+
+        keyboard = definition.get("keyboard")
+        if keyboard == "remove":
+            self.keyboard = ReplyKeyboardRemove()
+        elif keyboard is not None:
+            self.keyboard = ReplyKeyboardMarkup(keyboard)
+        elif self.answers:
+            self.keyboard = ReplyKeyboardMarkup([list(self.answers)])
+        else:
+            self.keyboard = None
+
+    @property
+    def is_final(self):
+        return not self.answers and self.input is None
+
+    def enter(self, update):
+        """Sends the prompts of the state and returns the state the conversation is in afterwards"""
+        last = len(self.prompts) - 1
+        for number, prompt in enumerate(self.prompts):
+            update.effective_message.reply_text(text=prompt, reply_markup=self.keyboard if number == last else None)
+        return ConversationHandler.END if self.is_final else self.name
+
+    def __call__(self, update, context):
+        message = update.effective_message
+        if self.answers:
+            target = self.answers.get(message.text)
+            if target is None:
+                message.reply_text(text=self.invalid)
+                return None
+            return self.flow.states[target].enter(update)
+
+        if message_kind(message) is not self.input:
+            message.reply_text(text=self.invalid)
+            return None
+        if self.action is not None and self.action(update, context) is False:
+            return ConversationHandler.END
+        if self.next is None:
+            return ConversationHandler.END
+        return self.flow.states[self.next].enter(update)
+
+
+class Flow(object):
+    """A conversation flow compiled from its definition.
+
+    Every state is handled by a single handler. Answers are looked up in a dict, prompts and keyboards are built once."""
+
+    def __init__(self, definition, actions=None):
+        self.actions = actions or dict()
+        self.name = definition["name"]
+        self.invalid = definition.get("invalid", "Sorry, but that's not any of the expected answers.")
+        self.greeting = definition.get("greeting")
+
+        entry = definition["entry"]
+        self.entry_command = entry["command"]
+        self.entry_action = self.action(entry.get("action"))
+
+        cancel = definition.get("cancel", dict())
+        self.cancel_commands = cancel.get("commands", ["cancel"])
+        self.cancel_prompt = cancel.get("prompt")
+        self._remove_keyboard = ReplyKeyboardRemove()
+
+        self.states = {name: FlowState(self, name, state) for name, state in definition["states"].items()}
+        self.start = self.states[definition["start"]]
+        for state in self.states.values():
+            for target in list(state.answers.values()) + [state.next]:
+                if target is not None and target not in self.states:
+                    raise ValueError("State {} refers to the unknown state {}".format(state.__name__, target))
+
+    @classmethod
+    def load(cls, path, actions=None):
+        with open(path, encoding="utf-8") as f:
+            return cls(yaml.safe_load(f), actions)
+
+    def action(self, name):
+        if name is None:
+            return None
+        if name not in self.actions:
+            raise ValueError("Flow {} uses the unknown action {}".format(self.name, name))
+        return self.actions[name]
+
+    def enter(self, update, context):
+        if self.entry_action is not None and self.entry_action(update, context) is False:
+            return ConversationHandler.END
+        if self.greeting:
+            update.effective_message.reply_text(text=self.greeting)
+        return self.start.enter(update)
+
+    def cancel(self, update, context):
+        if self.cancel_prompt:
+            update.effective_message.reply_text(text=self.cancel_prompt, reply_markup=self._remove_keyboard)
+        return ConversationHandler.END
+
+    def invalid_answer(self, update, context):
+        update.effective_message.reply_text(text=self.invalid)
+
+    def _callback(self, method):
+        """Returns a method as callback named after the flow, e.g. triage.enter"""
+
+        @wraps(method)
+        def callback(update, context):
+            return method(update, context)
+
+        callback.__name__ = "{}.{}".format(self.name, method.__name__)
+        return callback
+
+    def conversation_handler(self, persistent=False):
+        # Commands never count as answers, so that they reach the fallbacks
+        states = {name: [MessageHandler(~Filters.command, state)] for name, state in self.states.items() if not state.is_final}
+        return ConversationHandler(
+            entry_points=[CommandHandler(self.entry_command, self._callback(self.enter))],
+            states=states,
+            fallbacks=[CommandHandler(self.cancel_commands, self._callback(self.cancel)),
+                       MessageHandler(Filters.all, self._callback(self.invalid_answer))],
+            name=self.name,
+            persistent=persistent,
+        )
+
+
+def load_flows(directory, actions=None):
+    """Loads all flows defined in the .yaml files of a directory.
+
+    The flows are ordered by file name, which is the order their handlers are checked in, so busy flows should come first."""
+    return [Flow.load(os.path.join(directory, filename), actions)
+            for filename in sorted(os.listdir(directory)) if filename.endswith(".yaml")]
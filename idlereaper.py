@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class IdleReaper(object):
+    """Ends conversations in which nobody wrote anything for `timeout` seconds.
+
+    Relaying a message only stores the time of the last activity. Every conversation has one job on the JobQueue, due when
+    the conversation would expire without further activity. When the job fires after some activity, it's rescheduled for
+    the new deadline, otherwise the conversation is expired. So no message reschedules a job and no check scans all
+    conversations, an active conversation is looked at once per timeout."""
+
+    def __init__(self, expire_callback, timeout):
+        """expire_callback is called as expire_callback(context, user_id) with the user of the idle conversation.
+        A timeout of 0 disables the reaper"""
+        self.expire_callback = expire_callback
+        self.timeout = timeout
+        # user_id of the conversation's user -> time.monotonic() of the last message
+        self._activity = dict()
+        self._jobs = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._activity)
+
+    def watch(self, job_queue, conversation):
+        """Starts watching a new or restored conversation"""
+        if not self.timeout:
+            return
+        user_id = conversation.user.user_id
+        with self._lock:
+            self._activity[user_id] = time.monotonic()
+            self._schedule(job_queue, user_id, self.timeout)
+
+    def touch(self, user_id):
+        """Records activity in the conversation of user_id, called for every relayed message"""
+        with self._lock:
+            if user_id in self._activity:
+                self._activity[user_id] = time.monotonic()
+
+    def forget(self, user_id):
+        """Stops watching a conversation, e.g. once it has been stopped"""
+        with self._lock:
+            self._activity.pop(user_id, None)
+            job = self._jobs.pop(user_id, None)
+        if job is not None:
+            job.schedule_removal()
+
+    def _schedule(self, job_queue, user_id, delay):
+        old = self._jobs.get(user_id)
+        if old is not None:
+            old.schedule_removal()
+        self._jobs[user_id] = job_queue.run_once(self._check, delay, context=user_id, name="idle_{}".format(user_id))
+
+    def _check(self, context):
+        user_id = context.job.context
+        with self._lock:
+            last = self._activity.get(user_id)
+            if last is None or self._jobs.get(user_id) is not context.job:
+                return
+            remaining = last + self.timeout - time.monotonic()
+            if remaining > 0:
+                self._schedule(context.job_queue, user_id, remaining)
+                return
+            del self._activity[user_id]
+            del self._jobs[user_id]
+
+        try:
+            self.expire_callback(context, user_id)
+        except Exception:
+            logger.exception("Could not expire the conversation of user {}".format(user_id))
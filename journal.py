@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class Journal(object):
+    """Crash-safe record of the bot's state in a SQLite database in WAL mode.
+
+    The state is a set of records identified by (kind, key). Every mutation is appended to the journal table, a record
+    value of None deletes the record. compact() folds the journal into the snapshot table, so that restoring the state
+    only has to read the snapshot plus the mutations since the last compaction."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only loses the last transactions on power loss, not on a crash of the process
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+                         "key TEXT NOT NULL, value BLOB)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS journal_record ON journal (kind, key, seq)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS snapshot (kind TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                         "PRIMARY KEY (kind, key))")
+
+    def append(self, kind, key, value):
+        """Records that the record (kind, key) has been set to value, or deleted if value is None"""
+        blob = None if value is None else pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._db.execute("INSERT INTO journal (kind, key, value) VALUES (?, ?, ?)", (kind, str(key), blob))
+
+    def load(self):
+        """Returns the recorded state as dict kind -> dict key -> value"""
+        records = dict()
+        with self._lock:
+            for kind, key, blob in self._db.execute("SELECT kind, key, value FROM snapshot"):
+                records[(kind, key)] = blob
+            for kind, key, blob in self._db.execute("SELECT kind, key, value FROM journal ORDER BY seq"):
+                if blob is None:
+                    records.pop((kind, key), None)
+                else:
+                    records[(kind, key)] = blob
+
+        state = defaultdict(dict)
+        for (kind, key), blob in records.items():
+            state[kind][key] = pickle.loads(blob)
+        return state
+
+    def compact(self):
+        """Folds all journal entries into the snapshot and truncates the journal"""
+        with self._lock:
+            last_seq = self._db.execute("SELECT MAX(seq) FROM journal").fetchone()[0]
+            if last_seq is None:
+                return
+
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("INSERT OR REPLACE INTO snapshot (kind, key, value) "
+                                 "SELECT kind, key, value FROM journal AS j WHERE seq <= ? AND value IS NOT NULL "
+                                 "AND seq = (SELECT MAX(seq) FROM journal WHERE kind = j.kind AND key = j.key AND seq <= ?)",
+                                 (last_seq, last_seq))
+                self._db.execute("DELETE FROM snapshot WHERE (kind, key) IN "
+                                 "(SELECT kind, key FROM journal AS j WHERE seq <= ? AND value IS NULL "
+                                 "AND seq = (SELECT MAX(seq) FROM journal WHERE kind = j.kind AND key = j.key AND seq <= ?))",
+                                 (last_seq, last_seq))
+                self._db.execute("DELETE FROM journal WHERE seq <= ?", (last_seq,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.debug("Compacted journal up to entry {}".format(last_seq))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
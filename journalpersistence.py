@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import pickle
+from collections import defaultdict
+
+from telegram.ext import BasePersistence
+
+from contextstore import ExpiringDict
+
+
+class JournalPersistence(BasePersistence):
+    """Stores user_data, bot_data and the states of persistent ConversationHandlers in a Journal.
+
+    The dispatcher hands over user_data and bot_data after every update, so only data which changed since it was last
+    recorded is written to the journal. user_data is an ExpiringDict of up to max_users users, the data of users evicted
+    from it is deleted from the journal as well."""
+
+    def __init__(self, journal, state, max_users=100000, ttl=86400):
+        super(JournalPersistence, self).__init__(store_user_data=True, store_chat_data=False, store_bot_data=True)
+        self.journal = journal
+        # (kind, key) -> pickled data last written to the journal
+        self._written = dict()
+        self.user_data = ExpiringDict(dict, max_users, ttl, on_evict=self._drop_user_data,
+                                      data={int(user_id): data for user_id, data in state["user_data"].items()})
+        self.bot_data = state["bot_data"].get("bot_data", dict())
+        self.conversations = defaultdict(dict)
+        for name, key, new_state in state["conversation_state"].values():
+            self.conversations[name][key] = new_state
+
+    def _update(self, kind, key, data):
+        blob = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        if self._written.get((kind, key)) == blob:
+            return
+        self._written[(kind, key)] = blob
+        self.journal.append(kind, key, data)
+
+    def get_user_data(self):
+        return self.user_data
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return self.bot_data
+
+    def get_conversations(self, name):
+        # Handed over to the ConversationHandler, which updates the states itself before passing them on
+        return self.conversations.pop(name, dict())
+
+    def update_conversation(self, name, key, new_state):
+        self.journal.append("conversation_state", "{}:{}".format(name, key), None if new_state is None else (name, key, new_state))
+
+    def update_user_data(self, user_id, data):
+        # Most users never store anything, their empty dicts aren't worth a record
+        if not data and ("user_data", user_id) not in self._written:
+            return
+        self._update("user_data", user_id, data)
+
+    def _drop_user_data(self, user_id, data):
+        # Data restored from the journal hasn't been written by this process, but is in the journal
+        if self._written.pop(("user_data", user_id), None) is not None or data:
+            self.journal.append("user_data", user_id, None)
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def update_bot_data(self, data):
+        self._update("bot_data", "bot_data", data)
+
+    def flush(self):
+        self.journal.compact()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import logging
+import logging.config
+import logging.handlers
+import os
+import random
+import threading
+import time
+from queue import Queue, Full
+
+import yaml
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through `rate` records per second with bursts of up to `burst` records per call site.
+
+    The number of dropped records is appended to the next record let through, so floods stay visible in the log."""
+
+    def __init__(self, rate=1.0, burst=10):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        # (file, line) -> [tokens, last refill, dropped records]
+        self._buckets = dict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+
+        if dropped:
+            record.msg = "{} ({} similar messages suppressed)".format(record.getMessage(), dropped)
+            record.args = None
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Lets through a random share `ratio` of the records below WARNING, warnings and errors always pass"""
+
+    def __init__(self, ratio=0.01):
+        super(SampleFilter, self).__init__()
+        self.ratio = ratio
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.ratio
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler which drops records instead of blocking when the queue is full"""
+
+    def __init__(self, queue):
+        super(DroppingQueueHandler, self).__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+def setup_logging(config_path, queue_size=10000):
+    """Configures logging from the YAML file at config_path and moves the configured root handlers to a background thread.
+
+    Logging calls only put the record into a queue, a QueueListener writes them, so a stalled disk doesn't stall the bot.
+    Relative file names in the config are resolved against the project directory. Returns the started QueueListener."""
+    project_path = os.path.dirname(os.path.abspath(__file__))
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+
+    for handler in config.get("handlers", dict()).values():
+        filename = handler.get("filename")
+        if filename is None:
+            continue
+        if not os.path.isabs(filename):
+            filename = handler["filename"] = os.path.join(project_path, filename)
+        directory = os.path.dirname(filename)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    logging.config.dictConfig(config)
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    queue_handler = DroppingQueueHandler(Queue(maxsize=queue_size))
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
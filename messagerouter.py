@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from enum import Enum
+
+from resolvedconversation import resolve_conversation
+
+
+class MessageKind(Enum):
+    """Kinds of messages which can be relayed, the values are the names of the Message attributes.
+
+    Animations carry a document as well, so ANIMATION has to precede DOCUMENT."""
+    TEXT = "text"
+    PHOTO = "photo"
+    ANIMATION = "animation"
+    VOICE = "voice"
+    VIDEO = "video"
+    DOCUMENT = "document"
+    AUDIO = "audio"
+    STICKER = "sticker"
+
+
+def message_kind(message):
+    """Returns the MessageKind of a message or None for all other kinds of messages"""
+    for kind in MessageKind:
+        if getattr(message, kind.value):
+            return kind
+    return None
+
+
+class MessageRouter(object):
+    """Routes the private messages of conversation participants with a single lookup.
+
+    The kind of the message is determined once and the route is looked up by conversation type and kind in a table built at
+    startup. Text messages without a route are ignored, as they are answered by the other handlers. All other messages
+    without a route are passed to the fallback."""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self._routes = dict()
+
+    def add_route(self, conversation_type, kind, callback):
+        self._routes[(conversation_type, kind)] = callback
+
+    def route_message(self, update, context):
+        message = update.effective_message
+        kind = message_kind(message)
+        resolved = resolve_conversation(message)
+        callback = None if resolved is None else self._routes.get((resolved.type, kind))
+
+        if callback is not None:
+            return callback(update, context)
+        if kind is not MessageKind.TEXT:
+            return self.fallback(update, context)
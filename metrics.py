@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+import bisect
+import logging
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.error import RetryAfter
+from telegram.ext import ConversationHandler
+from telegram.utils.request import Request
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a cached lookup up to a slow Bot API call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join('{}="{}"'.format(name, value) for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.type)]
+        with self._lock:
+            samples = list(self._samples())
+        for suffix, labels, extra, value in samples:
+            lines.append("{}{}{} {}".format(self.name, suffix, _format_labels(self.labelnames, labels, extra), _format_value(value)))
+        return lines
+
+    def _samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield "", labels, None, value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super(Counter, self).__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge whose value is set explicitly or, if func is given, read when the metrics are collected.
+
+    func returns either a number or, for labelled gauges, a dict of label value tuples to numbers."""
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self.func = func
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def _samples(self):
+        if self.func is None:
+            yield from super(Gauge, self)._samples()
+            return
+        try:
+            value = self.func()
+        except Exception:
+            logger.exception("Collecting {} failed".format(self.name))
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, number in sorted(value.items()):
+            yield "", labels, None, number
+
+
+class CallbackCounter(Gauge):
+    """Counter whose value is maintained elsewhere, e.g. by the SendQueue, and read when the metrics are collected"""
+    type = "counter"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # Counts per bucket (not cumulative) plus the +Inf bucket, then the sum
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _samples(self):
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", labels, ("le", _format_value(bound)), cumulative
+            yield "_sum", labels, None, total
+            yield "_count", labels, None, cumulative
+
+
+class Metrics(object):
+    """Registry of all metrics of the bot, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self._register(Gauge(name, documentation, labelnames, func))
+
+    def callback_counter(self, name, documentation, func, labelnames=()):
+        return self._register(CallbackCounter(name, documentation, labelnames, func))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(object):
+    """Serves the metrics on http://listen:port/metrics from a background thread"""
+
+    def __init__(self, metrics, listen="0.0.0.0", port=8000):
+        self.metrics = metrics
+        self.listen = listen
+        self.port = port
+        self._server = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.listen, self.port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True)
+        thread.start()
+        logger.info("Serving metrics on port {}".format(self.port))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class InstrumentedRequest(Request):
+    """Request which records the duration of every Bot API call by method and counts flood limit (429) errors"""
+
+    def __init__(self, latency, flood_errors, *args, **kwargs):
+        super(InstrumentedRequest, self).__init__(*args, **kwargs)
+        self.latency = latency
+        self.flood_errors = flood_errors
+
+    def post(self, url, data, timeout=None):
+        labels = (url.rsplit("/", 1)[-1],)
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedRequest, self).post(url, data, timeout)
+        except RetryAfter:
+            self.flood_errors.inc(labels=labels)
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - start, labels)
+
+
+def instrument_handlers(dispatcher, observe):
+    """Wraps the callbacks of all handlers registered at the dispatcher, including the ones of ConversationHandlers.
+
+    observe(name, seconds) is called with the callback's name and duration after every call. Instrumenting the same
+    handlers again replaces the earlier instrumentation."""
+
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points + handler.fallbacks + [h for hs in handler.states.values() for h in hs]:
+                wrap(nested)
+            return
+
+        callback = getattr(handler, "_uninstrumented_callback", handler.callback)
+        handler._uninstrumented_callback = callback
+        name = getattr(callback, "__name__", repr(callback))
+
+        @wraps(callback)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+
+        handler.callback = timed
+
+    for group in dispatcher.groups:
+        for handler in dispatcher.handlers[group]:
+            wrap(handler)
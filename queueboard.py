@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+
+def _then(call, callback):
+    """Calls callback(result, error) once call() finished, without waiting for calls queued by a QueuedBot"""
+    try:
+        value = call()
+    except Exception as e:
+        callback(None, e)
+        return
+    if not isinstance(value, Future):
+        callback(value, None)
+        return
+
+    def done(future):
+        error = future.exception()
+        callback(None if error is not None else future.result(), error)
+
+    value.add_done_callback(done)
+
+
+class QueueBoard(object):
+    """One pinned message per room listing its waiting cases, edited in place instead of posting a message per case.
+
+    Changes to the queue only mark the board as outdated. The first change schedules an edit `delay` seconds later, but
+    not earlier than `min_interval` seconds after the previous one, so any number of changes in between cost one edit.
+    The board is rendered only when the edit is due and is not edited if its text and buttons didn't change. If the
+    message can't be edited anymore, e.g. because it has been deleted, a new one is posted and pinned.
+
+    The edits are sent through the bot's SendQueue without waiting for them, the job only queues them. While an edit is
+    being sent, further changes are collected and edited once it finished."""
+
+    def __init__(self, chat_id, render, delay=2, min_interval=5):
+        """render() returns the text and the reply_markup of the board. A chat_id of None disables the board"""
+        self.chat_id = chat_id
+        self.render = render
+        self.delay = delay
+        self.min_interval = min_interval
+        self.message_id = None
+        self.edits = 0
+        # chat_id -> message_id of the boards, e.g. a dict in bot_data so that the boards survive restarts
+        self._message_ids = dict()
+        self._rendered = None
+        self._job = None
+        self._job_queue = None
+        self._last_edit = 0
+        # True while an edit or post is being sent, _outdated if the board changed meanwhile
+        self._sending = False
+        self._outdated = False
+        self._lock = threading.Lock()
+
+    def attach(self, message_ids):
+        """Keeps the message id of the board in message_ids and continues with the board found there"""
+        self._message_ids = message_ids
+        self.message_id = message_ids.get(str(self.chat_id))
+
+    def update(self, job_queue):
+        """Marks the board as outdated, it's edited after a short delay"""
+        if self.chat_id is None:
+            return
+        with self._lock:
+            self._job_queue = job_queue
+            if self._job is not None:
+                return
+            delay = max(self.delay, self._last_edit + self.min_interval - time.monotonic())
+            self._job = job_queue.run_once(self._flush, delay, name="board_{}".format(self.chat_id))
+
+    def _flush(self, context):
+        with self._lock:
+            self._job = None
+            self._last_edit = time.monotonic()
+            if self._sending:
+                self._outdated = True
+                return
+            self._sending = True
+
+        try:
+            text, reply_markup = self.render()
+            rendered = (text, None if reply_markup is None else reply_markup.to_json())
+            if rendered == self._rendered:
+                self._finish()
+            elif self.message_id is None:
+                self._post(context.bot, text, reply_markup, rendered)
+            else:
+                self._edit(context.bot, text, reply_markup, rendered)
+        except Exception:
+            logger.exception("Could not update the queue board of {}".format(self.chat_id))
+            self._finish()
+
+    def _finish(self, rendered=None):
+        """Called once the board has been sent, with its rendering if the board changed"""
+        with self._lock:
+            self._sending = False
+            if rendered is not None:
+                self._rendered = rendered
+                self.edits += 1
+            outdated, self._outdated = self._outdated, False
+        if outdated:
+            self.update(self._job_queue)
+
+    def _edit(self, bot, text, reply_markup, rendered):
+        """Edits the board, posts a new one if the message can't be edited anymore"""
+
+        def done(result, error):
+            if isinstance(error, BadRequest) and "not modified" not in error.message.lower():
+                logger.warning("Queue board of {} can't be edited, posting a new one: {}".format(self.chat_id, error.message))
+                self._post(bot, text, reply_markup, rendered)
+            elif error is not None and not isinstance(error, BadRequest):
+                logger.error("Could not update the queue board of {}: {}".format(self.chat_id, error))
+                self._finish()
+            else:
+                self._finish(rendered)
+
+        _then(lambda: bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text,
+                                            reply_markup=reply_markup, disable_web_page_preview=True), done)
+
+    def _post(self, bot, text, reply_markup, rendered):
+
+        def pinned(result, error):
+            if error is not None:
+                # The bot needs to be an admin of the group to pin messages
+                logger.warning("Could not pin the queue board of {}: {}".format(self.chat_id, error))
+
+        def done(message, error):
+            if error is not None:
+                logger.error("Could not post the queue board of {}: {}".format(self.chat_id, error))
+                self._finish()
+                return
+            self.message_id = self._message_ids[str(self.chat_id)] = message.message_id
+            self._finish(rendered)
+            _then(lambda: bot.pin_chat_message(chat_id=self.chat_id, message_id=message.message_id,
+                                               disable_notification=True), pinned)
+
+        _then(lambda: bot.send_message(chat_id=self.chat_id, text=text, reply_markup=reply_markup,
+                                       disable_web_page_preview=True), done)
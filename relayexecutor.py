@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from queue import Queue
+
+logger = logging.getLogger(__name__)
+
+
+class RelayExecutor(object):
+    """Runs relay jobs on a fixed set of worker threads, sharded by conversation.
+
+    All jobs submitted with the same key are executed by the same worker in submission order, so the messages of one
+    conversation are never reordered, while a slow send only stalls the conversations sharing its worker. As long as the
+    executor is not running (or has no workers), jobs are executed right away on the calling thread."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._queues = []
+        self._threads = []
+        self.running = False
+        # Held while submitting and while starting or stopping, so that no job is put after the workers' last one
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.running or self.workers <= 0:
+                return
+            for number in range(self.workers):
+                queue = Queue()
+                thread = threading.Thread(target=self._worker, args=(queue,), name="RelayExecutor:{}".format(number), daemon=True)
+                self._queues.append(queue)
+                self._threads.append(thread)
+                thread.start()
+            self.running = True
+
+    def stop(self):
+        """Stops the workers after they processed the jobs submitted so far, later jobs run on the calling thread"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            for queue in self._queues:
+                queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._queues = []
+        self._threads = []
+
+    def pending(self):
+        """Returns the number of jobs waiting to be executed"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def submit(self, key, func, *args, **kwargs):
+        """Schedules func(*args, **kwargs) on the worker responsible for key"""
+        with self._lock:
+            if self.running:
+                self._queues[hash(key) % self.workers].put((func, args, kwargs))
+                return
+        self._run(func, args, kwargs)
+
+    def _worker(self, queue):
+        while True:
+            job = queue.get()
+            if job is None:
+                return
+            self._run(*job)
+
+    @staticmethod
+    def _run(func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Relaying a message failed")
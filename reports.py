@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from telegram import Update
+from telegram.ext import Handler
+
+
+class ReportStore(object):
+    """Counts the workers who reported a user and keeps the blocklist of users reported by at least `threshold` workers.
+
+    Each worker counts once per user, however often it reports. The blocklist is a set which is updated by every report
+    and unblock, so checking a user is a single set lookup and the reports are never rescanned. The reports are recorded
+    in the Journal, if one is attached."""
+
+    def __init__(self, threshold=2):
+        self.threshold = threshold
+        # user_id -> set of the ids of the workers who reported the user
+        self._reporters = dict()
+        self._blocked = set()
+        self._journal = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocked)
+
+    def attach_journal(self, journal, state):
+        """Restores the reports from the state loaded from journal and records all further reports in it"""
+        with self._lock:
+            for user_id, reporters in state["report"].items():
+                self._reporters[int(user_id)] = set(reporters)
+                if len(reporters) >= self.threshold:
+                    self._blocked.add(int(user_id))
+            self._journal = journal
+
+    def _record(self, user_id, reporters):
+        if self._journal is not None:
+            self._journal.append("report", user_id, None if reporters is None else sorted(reporters))
+
+    def is_blocked(self, user_id):
+        return user_id in self._blocked
+
+    def count_reports(self, user_id):
+        return len(self._reporters.get(user_id, ()))
+
+    def report(self, reporter_id, user_id):
+        """Records the report of user_id by a worker. Returns True if the user is blocked by this report"""
+        with self._lock:
+            reporters = self._reporters.setdefault(user_id, set())
+            if reporter_id in reporters:
+                return False
+            reporters.add(reporter_id)
+            self._record(user_id, reporters)
+            if user_id in self._blocked or len(reporters) < self.threshold:
+                return False
+            self._blocked.add(user_id)
+            return True
+
+    def unblock(self, user_id):
+        """Removes a user from the blocklist and forgets its reports. Returns True if the user was blocked"""
+        with self._lock:
+            if self._reporters.pop(user_id, None) is not None:
+                self._record(user_id, None)
+            if user_id not in self._blocked:
+                return False
+            self._blocked.discard(user_id)
+            return True
+
+
+class BlockedUserHandler(Handler):
+    """Handles every update sent by a blocked user.
+
+    Added in a group before all other handlers, the callback raises DispatcherHandlerStop. So the updates of blocked users
+    are dropped after a set lookup, before any ConversationHandler, filter or conversation lookup runs."""
+
+    def __init__(self, reports, callback):
+        super(BlockedUserHandler, self).__init__(callback)
+        self.reports = reports
+
+    def check_update(self, update):
+        if not isinstance(update, Update):
+            return False
+        user = update.effective_user
+        return user is not None and self.reports.is_blocked(user.id)
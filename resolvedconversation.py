@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from conversationrequest import ConversationType
+from conversations import Conversations
+
+PREFIXES = {
+    ConversationType.MEDICAL: "👩🏻‍⚕️: ",
+    ConversationType.SOCIAL: "🧔🏻: ",
+}
+
+_RESOLVED_ATTR = "_resolved_conversation"
+
+
+class ResolvedConversation(object):
+    """The sender's view of a Conversation: role, recipient and message prefix"""
+
+    def __init__(self, conversation, sender):
+        self.conversation = conversation
+        self.sender = sender
+        self.is_worker = sender == conversation.worker
+        self.recipient = conversation.user if self.is_worker else conversation.worker
+        self.prefix = PREFIXES.get(conversation.type)
+
+    @property
+    def type(self):
+        return self.conversation.type
+
+    def __repr__(self):
+        return "ResolvedConversation(sender: {}, recipient: {}, worker: {})".format(self.sender, self.recipient, self.is_worker)
+
+
+def resolve_conversation(message):
+    """Returns the ResolvedConversation of the message's sender or None.
+
+    The registry is only queried once per message, the result is cached on the message itself so that filters and handlers
+    processing the same update share it."""
+    if message is None or message.from_user is None:
+        return None
+
+    try:
+        return getattr(message, _RESOLVED_ATTR)
+    except AttributeError:
+        pass
+
+    sender = int(message.from_user.id)
+    conversation = Conversations().get_conversation(sender)
+    resolved = None if conversation is None else ResolvedConversation(conversation, sender)
+    setattr(message, _RESOLVED_ATTR, resolved)
+    return resolved
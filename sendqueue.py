@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from enum import IntEnum
+from functools import wraps
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class SendPriority(IntEnum):
+    RELAY = 1
+    NOTIFICATION = 2
+
+
+class TokenBucket(object):
+    """Allows bursts of up to capacity calls and rate calls per second on average"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def _fill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, now):
+        """Returns the number of seconds until a token is available"""
+        self._fill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._fill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._fill(now)
+        return self.tokens >= self.capacity
+
+
+def is_group(chat_id):
+    """Group, supergroup and channel ids are negative, channels might also be addressed by their @username"""
+    chat_id = str(chat_id)
+    return chat_id.startswith("-") or chat_id.startswith("@")
+
+
+class _Item(object):
+
+    def __init__(self, priority, func, args, kwargs):
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued_at = time.monotonic()
+        self.delay = None
+        self.attempts = 0
+
+
+class _Chat(object):
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.items = deque()
+        # True while the chat is in one of the heaps or one of its items is being sent
+        self.busy = False
+
+
+class SendQueue(object):
+    """Outbound queue respecting Telegram's flood limits.
+
+    Every call is rate limited by a global token bucket and a token bucket of the chat it is sent to. Calls to one chat are
+    executed in the order they were queued. Among the chats which may send, the one with the highest priority (lowest value)
+    is served first, so relayed messages overtake room notifications. A RetryAfter error pauses the whole queue for the time
+    Telegram asked for and the call is retried."""
+
+    def __init__(self, workers=4, global_rate=30, private_rate=1, private_burst=3, group_rate=20 / 60, group_burst=20, max_retries=3):
+        self.workers = workers
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = dict()
+        # (priority, seq, chat_id) of chats which can send as soon as the global bucket allows it
+        self._ready = []
+        # (ready_at, seq, chat_id) of chats waiting for their own bucket
+        self._delayed = []
+        self._seq = 0
+        self._paused_until = 0
+        self._last_sweep = time.monotonic()
+        self._cond = threading.Condition()
+        self._threads = []
+        self.running = False
+
+        # Metrics
+        self.depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        # Called with the seconds each sent item waited in the queue, e.g. Histogram.observe
+        self.observe_delay = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, name="SendQueue:{}".format(number), daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        """Stops the workers after they sent the items queued so far, while respecting the flood limits"""
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def put(self, chat_id, func, args=(), kwargs=None, priority=SendPriority.NOTIFICATION):
+        """Queues func(*args, **kwargs) for chat_id and returns a Future with its result"""
+        item = _Item(priority, func, args, kwargs or {})
+        with self._cond:
+            key = str(chat_id)
+            chat = self._chats.get(key)
+            if chat is None:
+                if is_group(key):
+                    bucket = TokenBucket(self.group_rate, self.group_burst)
+                else:
+                    bucket = TokenBucket(self.private_rate, self.private_burst)
+                chat = self._chats[key] = _Chat(bucket)
+            chat.items.append(item)
+            self.depth += 1
+            if not chat.busy:
+                self._schedule(key, chat)
+            self._cond.notify()
+        return item.future
+
+    def _schedule(self, key, chat):
+        """Puts a chat with queued items into the ready heap. Must be called with the lock held"""
+        chat.busy = True
+        self._seq += 1
+        heapq.heappush(self._ready, (chat.items[0].priority, self._seq, key))
+
+    def _next(self):
+        """Blocks until an item may be sent and returns (chat_id, chat, item) or None when the queue stopped and is empty"""
+        with self._cond:
+            # After stop() the workers continue until every queued item has been sent or has failed
+            while self.running or self.depth:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, key = heapq.heappop(self._delayed)
+                    self._seq += 1
+                    heapq.heappush(self._ready, (self._chats[key].items[0].priority, self._seq, key))
+
+                if not self._ready:
+                    self._sweep(now)
+                    self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+                    continue
+
+                wait = max(self._global.delay(now), self._paused_until - now)
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+
+                _, _, key = heapq.heappop(self._ready)
+                chat = self._chats[key]
+                wait = chat.bucket.delay(now)
+                if wait > 0:
+                    self._seq += 1
+                    heapq.heappush(self._delayed, (now + wait, self._seq, key))
+                    continue
+
+                chat.bucket.consume(now)
+                self._global.consume(now)
+                return key, chat, chat.items.popleft()
+        return None
+
+    def _done(self, key, chat, item, retry_after=None):
+        with self._cond:
+            if retry_after is not None:
+                self.retries += 1
+                chat.items.appendleft(item)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            else:
+                self.depth -= 1
+                if item.future.exception() is None:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+
+            if chat.items:
+                self._schedule(key, chat)
+                self._cond.notify()
+            else:
+                chat.busy = False
+                if not self.running:
+                    # Wakes the workers waiting for the last items to finish
+                    self._cond.notify_all()
+
+    def _sweep(self, now):
+        """Forgets idle chats whose bucket refilled completely, so that the queue doesn't keep a bucket for every chat ever seen"""
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for key in [key for key, chat in self._chats.items() if not chat.busy and chat.bucket.is_full(now)]:
+            del self._chats[key]
+
+    def _worker(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            key, chat, item = job
+
+            item.delay = time.monotonic() - item.queued_at
+            try:
+                result = item.func(*item.args, **item.kwargs)
+            except RetryAfter as e:
+                if item.attempts < self.max_retries:
+                    logger.warning("Flood limit hit while sending to {}, retrying in {}s".format(key, e.retry_after))
+                    item.attempts += 1
+                    self._done(key, chat, item, retry_after=e.retry_after)
+                    continue
+                item.future.set_exception(e)
+            except Exception as e:
+                logger.exception("Sending to {} failed".format(key))
+                item.future.set_exception(e)
+            else:
+                item.future.set_result(result)
+                if self.observe_delay is not None:
+                    self.observe_delay(item.delay)
+            self._done(key, chat, item)
+
+
+def queued(method, chat_arg=0):
+    """Routes a Bot method through the bot's SendQueue, private chats are sent with relay priority.
+
+    chat_arg is the position of the chat_id argument. Calls without a chat_id, e.g. edits of inline messages, aren't queued"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.send_queue is None or not self.send_queue.running:
+            return method(self, *args, **kwargs)
+
+        chat_id = kwargs["chat_id"] if "chat_id" in kwargs else args[chat_arg] if len(args) > chat_arg else None
+        if chat_id is None:
+            return method(self, *args, **kwargs)
+        priority = SendPriority.NOTIFICATION if is_group(chat_id) else SendPriority.RELAY
+        return self.send_queue.put(chat_id, method, (self,) + args, kwargs, priority)
+
+    return wrapper
+
+
+class QueuedBot(Bot):
+    """Bot which sends all messages through a SendQueue. Queued methods return a Future instead of the sent Message"""
+
+    def __init__(self, *args, send_queue=None, **kwargs):
+        super(QueuedBot, self).__init__(*args, **kwargs)
+        self.send_queue = send_queue
+
+    send_message = queued(Bot.send_message)
+    send_photo = queued(Bot.send_photo)
+    send_audio = queued(Bot.send_audio)
+    send_voice = queued(Bot.send_voice)
+    send_sticker = queued(Bot.send_sticker)
+    send_animation = queued(Bot.send_animation)
+    send_video = queued(Bot.send_video)
+    send_document = queued(Bot.send_document)
+    send_media_group = queued(Bot.send_media_group)
+    forward_message = queued(Bot.forward_message)
+    # Edits count towards the flood limits of a chat as well, e.g. the queue boards of the rooms
+    edit_message_text = queued(Bot.edit_message_text, chat_arg=1)
+    pin_chat_message = queued(Bot.pin_chat_message)
+
+    # The camelCase aliases inherited from Bot would bypass the queue
+    sendMessage = send_message
+    sendPhoto = send_photo
+    sendAudio = send_audio
+    sendVoice = send_voice
+    sendSticker = send_sticker
+    sendAnimation = send_animation
+    sendVideo = send_video
+    sendDocument = send_document
+    sendMediaGroup = send_media_group
+    forwardMessage = forward_message
+    editMessageText = edit_message_text
+    pinChatMessage = pin_chat_message
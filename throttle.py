@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from telegram import Update
+from telegram.ext import Handler
+
+from contextstore import ExpiringDict
+
+# Kinds of updates with separate limits
+MESSAGE = "message"
+COMMAND = "command"
+CALLBACK = "callback"
+
+
+def update_kind(update):
+    """Returns the kind of update throttled by a SenderThrottle, None for updates which aren't throttled.
+
+    Only private messages and button clicks are throttled, the messages of the workers in the rooms aren't relayed."""
+    if update.callback_query is not None:
+        return CALLBACK
+    message = update.message or update.edited_message
+    if message is None or message.chat.type != "private":
+        return None
+    if message.text is not None and message.text.startswith("/"):
+        return COMMAND
+    return MESSAGE
+
+
+class _Bucket(object):
+    __slots__ = ("tokens", "stamp", "noticed")
+
+    def __init__(self, tokens, stamp):
+        self.tokens = tokens
+        self.stamp = stamp
+        # True once the sender has been told that it's throttled
+        self.noticed = False
+
+
+class SenderThrottle(object):
+    """Token bucket per sender and kind of update, allowing bursts of `burst` updates and `rate` updates per second.
+
+    A bucket which hasn't been used for burst / rate seconds has refilled completely and is the same as a new one, so the
+    buckets of each kind are kept in an ExpiringDict with that TTL. Only the senders of the last few seconds or minutes
+    have a bucket, and at most maxsize per kind."""
+
+    def __init__(self, limits, maxsize=100000):
+        """limits maps the kind of update to (rate, burst), kinds without a limit or with a rate of 0 aren't throttled"""
+        self.limits = {kind: (rate, burst) for kind, (rate, burst) in limits.items() if rate > 0}
+        self._buckets = {kind: ExpiringDict(None, maxsize, burst / rate) for kind, (rate, burst) in self.limits.items()}
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(buckets) for buckets in self._buckets.values())
+
+    def allow(self, kind, user_id, now=None):
+        """Takes a token from the bucket of the sender, returns False if there was none"""
+        limit = self.limits.get(kind)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = time.monotonic() if now is None else now
+        buckets = self._buckets[kind]
+        with self._lock:
+            bucket = buckets.get(user_id)
+            if bucket is None:
+                bucket = buckets[user_id] = _Bucket(burst, now)
+            else:
+                bucket.tokens = min(burst, bucket.tokens + (now - bucket.stamp) * rate)
+                bucket.stamp = now
+                if bucket.tokens == burst:
+                    # The sender slowed down long enough, it's told again next time
+                    bucket.noticed = False
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return True
+            self.throttled += 1
+            return False
+
+    def take_notice(self, kind, user_id):
+        """Returns True for the first throttled update of a sender, until its bucket has refilled completely"""
+        with self._lock:
+            bucket = self._buckets[kind].get(user_id)
+            if bucket is None or bucket.noticed:
+                return False
+            bucket.noticed = True
+            return True
+
+    def expire(self):
+        """Drops the buckets which have refilled completely, returns their number"""
+        return sum(buckets.expire() for buckets in self._buckets.values())
+
+
+class ThrottledUpdateHandler(Handler):
+    """Handles the updates exceeding the limits of their sender.
+
+    Added in a group before all other handlers, the callback drops the update with DispatcherHandlerStop. The callback
+    can tell the sender once, see SenderThrottle.take_notice()."""
+
+    def __init__(self, throttle, callback):
+        super(ThrottledUpdateHandler, self).__init__(callback)
+        self.throttle = throttle
+
+    def check_update(self, update):
+        if not isinstance(update, Update) or update.effective_user is None:
+            return False
+        kind = update_kind(update)
+        return kind is not None and not self.throttle.allow(kind, update.effective_user.id)
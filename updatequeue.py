@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from queue import Queue, Full
+
+from tornado.web import HTTPError
+
+
+class WebhookUpdateQueue(Queue):
+    """Bounded update queue for webhook mode, which rejects updates instead of waiting for room.
+
+    PTB's webhook puts every update into the queue on tornado's IO loop. A blocking put on a full queue would freeze every
+    open webhook connection, so put() waits at most `timeout` seconds and then answers the request with 503. Telegram
+    delivers a rejected update again later."""
+
+    def __init__(self, maxsize, timeout=0.1):
+        super(WebhookUpdateQueue, self).__init__(maxsize)
+        self.timeout = timeout
+        self.rejected = 0
+
+    def put(self, item, block=True, timeout=None):
+        try:
+            super(WebhookUpdateQueue, self).put(item, block, self.timeout if timeout is None else timeout)
+        except Full:
+            self.rejected += 1
+            raise HTTPError(503, "Update queue is full")
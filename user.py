@@ -3,6 +3,8 @@ import time
 
 
 class User(object):
+    # Hundreds of thousands of users can be waiting at once, slots save the per instance __dict__
+    __slots__ = ("user_id", "first_name", "last_name", "username")
 
     def __init__(self, user_id, first_name=None, last_name=None, username=None):
         self.user_id = int(user_id)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+
+class WaitingLine(object):
+    """FIFO line of ConversationRequests keyed by user id.
+
+    Requests are kept in arrival order, which is also the order of their waiting_since timestamps. Membership, append and
+    removal are O(1), the position of a user in the line is looked up in O(log n) through a Fenwick tree over the arrival
+    sequence numbers. Plain dicts keep the insertion order at about half the size of an OrderedDict."""
+
+    def __init__(self):
+        # user_id -> request, in arrival order
+        self._requests = dict()
+        # user_id -> sequence number
+        self._seqs = dict()
+        # Fenwick tree counting the waiting requests per sequence number, index 0 is unused
+        self._tree = [0]
+
+    def __len__(self):
+        return len(self._requests)
+
+    def __contains__(self, user_id):
+        return user_id in self._requests
+
+    def __iter__(self):
+        return iter(self._requests.values())
+
+    def get(self, user_id):
+        return self._requests.get(user_id)
+
+    def append(self, req):
+        user_id = req.user.user_id
+        if user_id in self._requests:
+            raise ValueError("User {} is already in line".format(user_id))
+
+        seq = len(self._tree)
+        # Appending index i to a Fenwick tree: it covers the range (i - lowbit(i), i]
+        self._tree.append(1 + self._prefix(seq - 1) - self._prefix(seq - (seq & -seq)))
+        self._requests[user_id] = req
+        self._seqs[user_id] = seq
+
+    def extend(self, reqs):
+        """Appends several requests at once, rebuilding the tree in O(n) instead of appending one by one"""
+        for req in reqs:
+            user_id = req.user.user_id
+            if user_id in self._requests:
+                raise ValueError("User {} is already in line".format(user_id))
+            self._requests[user_id] = req
+        self._compact()
+
+    def remove(self, user_id):
+        """Removes the request of a user and returns it, or None if the user is not waiting"""
+        req = self._requests.pop(user_id, None)
+        if req is None:
+            return None
+
+        self._add(self._seqs.pop(user_id), -1)
+        if len(self._tree) > 64 and len(self._requests) * 2 < len(self._tree):
+            self._compact()
+        return req
+
+    def position(self, user_id):
+        """Returns the 1-based position of a user in line or None if the user is not waiting"""
+        seq = self._seqs.get(user_id)
+        if seq is None:
+            return None
+        return self._prefix(seq)
+
+    def waiting_since(self, deadline):
+        """Yields the requests waiting since deadline or earlier, oldest first.
+
+        Iteration stops at the first request that is not overdue, so only the overdue entries are touched."""
+        for req in self._requests.values():
+            if req.waiting_since > deadline:
+                return
+            yield req
+
+    def _prefix(self, index):
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _add(self, index, delta):
+        size = len(self._tree)
+        while index < size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def _compact(self):
+        """Renumbers the remaining entries so that the tree doesn't grow with every request ever seen"""
+        size = len(self._requests)
+        tree = [0] + [1] * size
+        for index in range(1, size + 1):
+            parent = index + (index & -index)
+            if parent <= size:
+                tree[parent] += tree[index]
+
+        self._seqs = dict(zip(self._requests, range(1, size + 1)))
+        self._tree = tree